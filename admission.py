@@ -0,0 +1,128 @@
+# admission.py
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _Waiter:
+    def __init__(self, priority):
+        self.priority = priority
+        self.state = 'waiting'
+        self.ready = threading.Event()
+
+
+class AdmissionController:
+    """
+    Bounded concurrency with a bounded, prioritised queue in front of it.
+
+    At most max_concurrent requests run at once. Others wait in a queue of at
+    most max_queue requests, served by priority (lower number first) and in
+    arrival order within a priority. A request is shed instead of queued when
+    it has waited max_wait seconds, or when the queue is full and nothing in it
+    has a lower priority to give up its place. Shedding early keeps the wait,
+    and so the latency, of the admitted requests bounded under overload.
+    """
+
+    def __init__(self, max_concurrent, max_queue, max_wait, priorities=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.priorities = priorities or {}
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queue = []
+        self._queued = 0
+        self._order = itertools.count()
+        self._counters = {}
+
+    def _count(self, endpoint, outcome, wait=0.0):
+        counters = self._counters.setdefault(endpoint, {'admitted': 0, 'shed': 0, 'wait_seconds': 0.0})
+        counters[outcome] += 1
+        counters['wait_seconds'] += wait
+
+    def _evict_for(self, priority):
+        # Queue is full: shed the newest waiter of the lowest priority, if it ranks below the newcomer.
+        waiting = [entry for entry in self._queue if entry[2].state == 'waiting']
+        if not waiting:
+            return False
+        worst = max(waiting, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            return False
+        worst[2].state = 'shed'
+        self._queued -= 1
+        worst[2].ready.set()
+        return True
+
+    def admit(self, endpoint):
+        """
+        Waits for a slot for a request to `endpoint`. Returns True when the
+        request may run (it must call release() when done), False when it was shed.
+        """
+        priority = self.priorities.get(endpoint, 0)
+        with self._lock:
+            if self._running < self.max_concurrent and self._queued == 0:
+                self._running += 1
+                self._count(endpoint, 'admitted')
+                return True
+            if self._queued >= self.max_queue and not self._evict_for(priority):
+                self._count(endpoint, 'shed')
+                return False
+            waiter = _Waiter(priority)
+            heapq.heappush(self._queue, (priority, next(self._order), waiter))
+            self._queued += 1
+
+        started = time.perf_counter()
+        waiter.ready.wait(self.max_wait)
+        with self._lock:
+            waited = time.perf_counter() - started
+            if waiter.state == 'waiting':
+                # Timed out; the entry stays in the heap and is skipped by release().
+                waiter.state = 'shed'
+                self._queued -= 1
+            self._count(endpoint, 'admitted' if waiter.state == 'admitted' else 'shed', waited)
+            return waiter.state == 'admitted'
+
+    def release(self):
+        """
+        Frees the slot of a finished request, handing it to the first waiter in line.
+        """
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.state == 'waiting':
+                    waiter.state = 'admitted'
+                    self._queued -= 1
+                    waiter.ready.set()
+                    return
+            self._running -= 1
+
+    @contextmanager
+    def slot(self, endpoint):
+        """
+        with controller.slot('recommendations') as admitted: ... releases the slot on exit.
+        """
+        admitted = self.admit(endpoint)
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'running': self._running,
+                'queued': self._queued,
+                'endpoints': {
+                    endpoint: {
+                        'admitted': counters['admitted'],
+                        'shed': counters['shed'],
+                        'mean_wait_ms': round(1000 * counters['wait_seconds'] /
+                                              max(1, counters['admitted'] + counters['shed']), 3),
+                    }
+                    for endpoint, counters in self._counters.items()
+                },
+            }
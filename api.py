@@ -1,11 +1,22 @@
 # api.py
 
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import numpy as np
 import os
+import time
+
+# Only what serving needs is imported here. Building a model from a CSV pulls
+# in pandas and SciPy, so those imports live inside build_model_from_data.
+from admission import AdmissionController
+from experiments import Experiment, parse_variants
+from item_filters import load_item_filters
+from rec_store import RecommendationStore
+from model_holder import ModelHolder
+from model_registry import ModelRegistry
+from ranked_list_cache import RankedListCache, make_cursor, parse_cursor
+from recommender_model import load_model, warm_up_model
+from shadow import ShadowScorer
+from single_flight import SingleFlight
 
 # --- VIBE CODING: FAKE PRODUCT CATALOG ---
 # In a real application, this data would come from a database.
@@ -45,29 +56,156 @@ PRODUCT_CATALOG = {
     }
 }
 
+# Memory the model build may use. The sample size, the number of neighbours kept
+# per item and the min_interactions threshold are all chosen to fit in it.
+MEMORY_BUDGET_MB = int(os.environ.get('RECOMMENDER_MEMORY_BUDGET_MB', '1024'))
+
+# Products returned by /similar when the request does not say.
+DEFAULT_NUM_SIMILAR = 10
+
+# Optional SQLite file with precomputed recommendations for the heaviest users.
+# Unset = score every request.
+RECOMMENDATION_STORE_PATH = os.environ.get('RECOMMENDER_STORE_PATH')
+RECOMMENDATION_STORE_USERS = int(os.environ.get('RECOMMENDER_STORE_USERS', '10000'))
+
+# Where the model comes from at startup and on /admin/reload: a directory written
+# by save_model (or the out-of-core/sharded builds) or a processed data CSV.
+MODEL_SOURCE = os.environ.get('RECOMMENDER_MODEL_SOURCE', r'D:\Datasets\processed_ecommerce_data.csv')
+
+# Optional CSV of product attributes (category, in_stock, blocked, regions) for
+# filtering recommendations. Unset = no business rules.
+ITEM_ATTRIBUTES_PATH = os.environ.get('RECOMMENDER_ITEM_ATTRIBUTES')
+
+# Optional directory of per-category models (see model_registry.py). Requests with
+# ?category=<name> are served by that category's model, which is mapped in on
+# first use; the least recently used ones are dropped to stay under the cap.
+MODEL_REGISTRY_PATH = os.environ.get('RECOMMENDER_MODEL_REGISTRY')
+REGISTRY_MEMORY_MB = int(os.environ.get('RECOMMENDER_REGISTRY_MEMORY_MB', '2048'))
+
+# Optional A/B variants of the serving model for /recommendations, e.g.
+# "control=50,k20=25;k=20,strict=25;min_similarity=0.1" (see experiments.py).
+# Users are assigned by a hash of RECOMMENDER_EXPERIMENT and their id. Unset = no experiment.
+VARIANTS_SPEC = os.environ.get('RECOMMENDER_VARIANTS')
+EXPERIMENT_NAME = os.environ.get('RECOMMENDER_EXPERIMENT', 'experiment')
+
+# Optional candidate model (a saved model directory) scored in the background on
+# SHADOW_SAMPLE_RATE of the /recommendations requests and compared with what was
+# served; the comparisons are appended to SHADOW_LOG_PATH. POST /admin/shadow
+# starts, replaces or stops it at runtime.
+SHADOW_MODEL_PATH = os.environ.get('RECOMMENDER_SHADOW_MODEL')
+SHADOW_SAMPLE_RATE = float(os.environ.get('RECOMMENDER_SHADOW_SAMPLE_RATE', '0.05'))
+SHADOW_LOG_PATH = os.environ.get('RECOMMENDER_SHADOW_LOG', 'shadow_metrics.jsonl')
+SHADOW_WORKERS = int(os.environ.get('RECOMMENDER_SHADOW_WORKERS', '1'))
+
+# The /admin endpoints require this value in the X-Admin-Token header; while it
+# is unset they are disabled.
+ADMIN_TOKEN = os.environ.get('RECOMMENDER_ADMIN_TOKEN')
+
+# Directories (separated by os.pathsep) that /admin/reload and /admin/shadow may
+# load models or data from. Default: the directory holding MODEL_SOURCE.
+MODEL_LOCATIONS = [location for location in os.environ.get(
+    'RECOMMENDER_MODEL_LOCATIONS', os.path.dirname(os.path.abspath(MODEL_SOURCE))).split(os.pathsep) if location]
+
+# Synthetic queries run on a new model before it is swapped in and reported ready.
+WARMUP_QUERIES = int(os.environ.get('RECOMMENDER_WARMUP_QUERIES', '200'))
+
+# Processes used to compute the item neighbours (1 = build in this process).
+BUILD_WORKERS = int(os.environ.get('RECOMMENDER_BUILD_WORKERS', os.cpu_count() or 1))
+
+# Time budget of a /recommendations request unless it passes ?deadline_ms=...
+# (0 = no deadline). Past it, users with long histories get recommendations
+# from their highest-rated products only.
+DEFAULT_DEADLINE_MS = float(os.environ.get('RECOMMENDER_DEADLINE_MS', '100'))
+
+# Diversity re-ranking of /recommendations: ?diversity= between 0 (off, the
+# default here) and 1 trades relevance for products unlike those already listed.
+# It re-ranks the best DIVERSITY_CANDIDATES scored products.
+DEFAULT_DIVERSITY = float(os.environ.get('RECOMMENDER_DIVERSITY', '0'))
+DIVERSITY_CANDIDATES = 100
+
+# Paging of /recommendations with ?limit=..&cursor=..: the first page ranks
+# RANKED_LIST_DEPTH products once and keeps the list for PAGE_CACHE_SECONDS;
+# the cursor of the next page comes back in the X-Next-Cursor header.
+DEFAULT_PAGE_SIZE = 5
+MAX_PAGE_SIZE = 50
+RANKED_LIST_DEPTH = 200
+PAGE_CACHE_SECONDS = 600
+
+# Admission control: at most MAX_CONCURRENT_REQUESTS requests run at once and at most
+# MAX_QUEUED_REQUESTS wait for a turn. A request that would wait longer than
+# MAX_QUEUE_WAIT_MS is shed: recommendations fall back to popular products,
+# other endpoints answer 503.
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('RECOMMENDER_MAX_CONCURRENT', os.cpu_count() or 1))
+MAX_QUEUED_REQUESTS = int(os.environ.get('RECOMMENDER_MAX_QUEUED', '64'))
+MAX_QUEUE_WAIT_MS = float(os.environ.get('RECOMMENDER_MAX_QUEUE_WAIT_MS', '100'))
+
+# Which requests go first when they have to queue (lower = sooner), and which
+# give up their place in a full queue.
+ENDPOINT_PRIORITIES = {'recommendations': 0, 'session': 0, 'similar': 1, 'users': 2}
+
 app = Flask(__name__)
-CORS(app) 
+CORS(app, expose_headers=['X-Recommendations-Degraded', 'X-Next-Cursor', 'X-Recommendations-Variant']) 
 
-user_item_matrix = None
-item_similarity_df = None
-processed_df = None
+# The serving model. Handlers take model_holder.current() once per request, so a
+# reload never switches models in the middle of a request.
+model_holder = ModelHolder()
 
-def build_recommender_model(data_path):
-    global user_item_matrix, item_similarity_df, processed_df
-    
-    print("--- VIBE CODING: BUILDING RECOMMENDER MODEL ON SERVER STARTUP ---")
+# Concurrent requests for the same user share one scoring run.
+recommendation_flight = SingleFlight()
+
+recommendation_store = RecommendationStore(RECOMMENDATION_STORE_PATH) if RECOMMENDATION_STORE_PATH else None
+
+def prepare_partition_model(model):
+    if ITEM_ATTRIBUTES_PATH:
+        model.item_filters = load_item_filters(ITEM_ATTRIBUTES_PATH, model.item_ids)
+
+model_registry = ModelRegistry(MODEL_REGISTRY_PATH, REGISTRY_MEMORY_MB * 2**20,
+                               prepare_partition_model) if MODEL_REGISTRY_PATH else None
+
+experiment = Experiment(parse_variants(VARIANTS_SPEC), EXPERIMENT_NAME) if VARIANTS_SPEC else None
+
+# Started by start_shadow, never at import: the shadow workers are spawned
+# processes, and each of them imports this module again.
+shadow_scorer = None
+
+ranked_lists = RankedListCache(ttl_seconds=PAGE_CACHE_SECONDS)
+
+admission = AdmissionController(MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, MAX_QUEUE_WAIT_MS / 1000,
+                                ENDPOINT_PRIORITIES)
+
+# What the current model load or reload is doing, reported by /readyz.
+started_at = time.time()
+load_progress = {'stage': 'not started', 'since': started_at}
+
+def set_load_stage(stage):
+    global load_progress
+    load_progress = {'stage': stage, 'since': time.time()}
+    print(f"[load] {stage}")
+
+def build_model_from_data(data_path):
+    from recommender_model import build_model
+    from sampling import count_interactions, plan_sample, stream_sample_users
+
+    print("--- VIBE CODING: BUILDING RECOMMENDER MODEL ---")
     
+    set_load_stage('counting interactions')
     try:
-        df = pd.read_csv(data_path)
+        user_counts, product_counts = count_interactions(data_path)
     except FileNotFoundError:
         print(f"Error: Processed data file not found at {data_path}. Please check the path.")
-        return False
+        return None
     
-    sample_size = 150000 
-    print(f"Taking a random sample of {sample_size} records from the full dataset.")
-    df = df.sample(n=sample_size, random_state=42).reset_index(drop=True)
+    plan = plan_sample(user_counts, product_counts, MEMORY_BUDGET_MB * 2**20, workers=BUILD_WORKERS)
+    if plan is None:
+        print("Error: The model does not fit in the configured memory budget.")
+        return None
+    
+    min_interactions = plan['min_interactions']
+    set_load_stage('sampling users')
+    print(f"Sampling whole users up to a budget of {plan['row_budget']} records from the full dataset.")
+    df = stream_sample_users(data_path, row_budget=plan['row_budget'], min_interactions=min_interactions,
+                             stratify=True, random_state=42, k=plan['k'], user_counts=user_counts)
     
-    min_interactions = 5
     user_counts = df['user_id'].value_counts()
     product_counts = df['product_id'].value_counts()
     
@@ -77,78 +215,382 @@ def build_recommender_model(data_path):
     df = df[df['user_id'].isin(filtered_users) & df['product_id'].isin(filtered_products)]
     print(f"Data sample after filtering sparse interactions: {len(df)} records")
     
-    processed_df = df
-    
+    set_load_stage('building matrix and neighbour index')
     print("\nCreating the user-item matrix from the sample data...")
-    user_item_matrix = df.pivot_table(index='product_id', columns='user_id', values='rating').fillna(0)
-    
-    print("User-Item matrix created. Shape:", user_item_matrix.shape)
+    return build_model(df, k=plan['k'], workers=BUILD_WORKERS)
 
-    print("\nCalculating item similarity using Cosine Similarity...")
-    item_similarity_matrix = cosine_similarity(user_item_matrix)
+def load_serving_model(source):
+    """
+    Loads a saved model directory, or builds a model from a processed data CSV,
+    and warms it up so it is ready for traffic as soon as it is swapped in.
+    """
+    if os.path.isdir(source):
+        set_load_stage(f'loading model from {source}')
+        model = load_model(source)
+    else:
+        model = build_model_from_data(source)
+    if model is not None and ITEM_ATTRIBUTES_PATH:
+        set_load_stage('loading item filters')
+        model.item_filters = load_item_filters(ITEM_ATTRIBUTES_PATH, model.item_ids)
+    if model is not None and experiment is not None:
+        # A variant that does not fit the new model (e.g. factors trained for
+        # another build) fails the load, so the old model keeps serving.
+        set_load_stage('deriving experiment variants')
+        try:
+            experiment.models_for(model, strict=True)
+        except ValueError:
+            set_load_stage('failed')
+            raise
+    if model is not None:
+        set_load_stage('warming up')
+        warm_up_model(model, WARMUP_QUERIES)
+    set_load_stage('finished' if model is not None else 'failed')
+    return model
+
+def start_shadow(directory, sample_rate=SHADOW_SAMPLE_RATE):
+    """
+    Starts shadow scoring with the model in directory, replacing any running
+    one; None stops it.
+    """
+    global shadow_scorer
+    previous, shadow_scorer = shadow_scorer, None
+    if previous is not None:
+        previous.close()
+    if directory:
+        shadow_scorer = ShadowScorer(directory, sample_rate, SHADOW_LOG_PATH, SHADOW_WORKERS)
+        print(f"Shadow scoring {sample_rate:.1%} of requests with {directory}.")
+
+def on_model_swap(model):
+    if experiment is not None:
+        # Derives the variant models before they are asked for.
+        experiment.models_for(model)
+    if recommendation_store is not None:
+        recommendation_store.refresh_in_background(model, RECOMMENDATION_STORE_USERS)
+
+def build_recommender_model(source):
+    model = load_serving_model(source)
+    if model is None:
+        return False
     
-    item_similarity_df = pd.DataFrame(item_similarity_matrix, index=user_item_matrix.index, columns=user_item_matrix.index)
+    problems = model_holder.swap(model)
+    if problems:
+        print(f"Error: The new model failed its checks: {problems}")
+        return False
+    on_model_swap(model)
     
     print("\n--- Model build complete! The API is ready to serve requests. ---")
     return True
 
-def get_recommendations_for_user(user_id, num_recommendations=5):
-    if user_item_matrix is None or item_similarity_df is None:
+def get_recommendations_for_user(user_id, num_recommendations=5, model=None, deadline=None, allowed=None,
+                                 diversity=0.0, explain=False):
+    """
+    Returns (recommendations, degraded). With a deadline (a time.perf_counter()
+    value) a long history is only scored as far as time allows; degraded is then
+    'partial', or 'popular' when the deadline passed before scoring could start.
+    allowed is the filter mask from item_filter_mask. With diversity > 0 the
+    best DIVERSITY_CANDIDATES are scored and re-ranked by model.diversify.
+    With explain, scored recommendations carry their top contributing products.
+    """
+    if diversity > 0:
+        candidates, degraded = get_recommendations_for_user(
+            user_id, max(DIVERSITY_CANDIDATES, num_recommendations), model, deadline, allowed, explain=explain)
+        model = model or model_holder.current()
+        return model.diversify(candidates, num_recommendations, diversity), degraded
+
+    model = model or model_holder.current()
+    if model is None:
         print("Model not loaded. Cannot generate recommendations.")
-        return []
+        return [], None
 
-    if user_id not in user_item_matrix.columns:
+    if not model.has_user(user_id):
         print(f"User ID '{user_id}' not found in the sample data. Cannot provide personalized recommendations.")
-        return []
+        return [], None
 
-    user_ratings = user_item_matrix.loc[:, user_id]
-    rated_products = user_ratings[user_ratings > 0].index.tolist()
-    
-    recommendation_scores = {}
-    
-    for rated_product in rated_products:
-        if rated_product not in item_similarity_df.columns:
-            continue
-        
-        similar_items = item_similarity_df[rated_product].sort_values(ascending=False)
-        
-        for similar_product, similarity_score in similar_items.items():
-            if similar_product not in recommendation_scores:
-                recommendation_scores[similar_product] = 0
-            
-            user_rating_for_product = user_ratings.loc[rated_product]
-            recommendation_scores[similar_product] += similarity_score * user_rating_for_product
+    # Stored lists carry no explanations.
+    if recommendation_store is not None and not explain:
+        stored = recommendation_store.get(user_id, model.version, num_recommendations)
+        # Stored lists are unfiltered; one that breaks a rule is scored again instead.
+        if stored is not None and (allowed is None or all(allowed[model.item_index[product_id]]
+                                                          for product_id, _ in stored)):
+            return stored, None
 
-    for product in rated_products:
-        if product in recommendation_scores:
-            del recommendation_scores[product]
+    if deadline is None:
+        return model.recommend(user_id, num_recommendations, allowed, explain), None
+    if time.perf_counter() >= deadline:
+        return model.popular_items(num_recommendations, allowed), 'popular'
+    recommendations, complete = model.recommend_until(user_id, deadline, num_recommendations, allowed, explain)
+    if complete:
+        return recommendations, None
+    # The products merged in time may all be ones the user already rated.
+    if not recommendations:
+        return model.popular_items(num_recommendations, allowed), 'popular'
+    return recommendations, 'partial'
 
-    recommended_products = sorted(recommendation_scores.items(), key=lambda x: x[1], reverse=True)
-    
-    return recommended_products[:num_recommendations]
+def item_filter_mask(model, args):
+    """
+    The item mask for a request's ?categories=a,b&region=..&include_out_of_stock=true,
+    plus a hashable key for it. Without item filters loaded there is no mask.
+    Blocked products are excluded from every request.
+    """
+    if model.item_filters is None:
+        return None, None
+    key = (
+        tuple(sorted(category for category in args.get('categories', '').split(',') if category)) or None,
+        args.get('region') or None,
+        args.get('include_out_of_stock', 'false').lower() == 'true',
+    )
+    return model.item_filters.mask(*key), key
+
+def format_products(scored_products):
+    formatted_products = []
+    for prod_id, score, *explanation in scored_products:
+        product_info = PRODUCT_CATALOG.get(prod_id, {
+            'name': 'Product ' + prod_id,
+            'image_url': 'https://via.placeholder.com/150'
+        })
+        formatted_products.append({
+            'product_id': prod_id,
+            'name': product_info['name'],
+            'image_url': product_info['image_url'],
+            'score': float(score)
+        })
+        if explanation:
+            formatted_products[-1]['because'] = [{'product_id': source, 'share': round(share, 4)}
+                                                 for source, share in explanation[0]]
+    return formatted_products
+
+def request_model():
+    """
+    The model a request is served by: the model of its ?category= when given,
+    otherwise the main serving model. Returns (model, None), or (None, error response).
+    """
+    category = request.args.get('category')
+    if not category:
+        model = model_holder.current()
+        if model is None:
+            return None, (jsonify({"message": "Model not loaded."}), 503)
+        return model, None
+    if model_registry is None:
+        return None, (jsonify({"message": "No per-category models are configured."}), 400)
+    try:
+        return model_registry.get(category), None
+    except KeyError:
+        return None, (jsonify({"message": f"Unknown category '{category}'."}), 404)
+
+def overloaded_response(model=None, num_recommendations=5, allowed=None):
+    """
+    Answer for a request shed by admission control: the popular products when
+    there is a model to take them from, otherwise 503.
+    """
+    if model is not None:
+        response = jsonify(format_products(model.popular_items(num_recommendations, allowed)))
+        response.headers['X-Recommendations-Degraded'] = 'overloaded'
+        return response
+    response = jsonify({"message": "Server is overloaded, please retry shortly."})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def page_response(ranked, token, offset, limit, degraded=None):
+    response = jsonify(format_products(ranked[offset:offset + limit]))
+    if offset + limit < len(ranked):
+        response.headers['X-Next-Cursor'] = make_cursor(token, offset + limit)
+    if degraded:
+        response.headers['X-Recommendations-Degraded'] = degraded
+    return response
+
+def with_variant(response, variant):
+    if variant is not None:
+        response.headers['X-Recommendations-Variant'] = variant
+    return response
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _num_similar(requested, model):
+    # At most the k neighbours kept per item are available. A JSON body can
+    # carry any type, so anything but an integer is rejected before comparing.
+    if requested is not None and (not isinstance(requested, int) or isinstance(requested, bool)):
+        return None, (jsonify({"message": "'n' must be an integer."}), 400)
+    if not requested or requested < 1:
+        return DEFAULT_NUM_SIMILAR, None
+    return min(requested, model.k), None
 
 @app.route('/recommendations/<user_id>', methods=['GET'])
 def get_recommendations(user_id):
     print(f"API request received for user: {user_id}")
     
-    recommendations = get_recommendations_for_user(user_id)
+    # The budget starts when the request arrives, so time spent queueing counts.
+    deadline_ms = request.args.get('deadline_ms', DEFAULT_DEADLINE_MS, type=float)
+    deadline = time.perf_counter() + deadline_ms / 1000 if deadline_ms > 0 else None
+
+    # Later pages are slices of the list ranked for the first one. When that
+    # list has expired, it is ranked again and paging goes on from the same offset.
+    limit, cursor = request.args.get('limit', type=int), request.args.get('cursor')
+    paged = limit is not None or cursor is not None
+    limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    token, offset = parse_cursor(cursor) if cursor else (None, 0)
+    if cursor and token is None:
+        return jsonify({"message": "Malformed cursor."}), 400
+    listing = ranked_lists.get(token) if token else None
+    if listing is not None:
+        if (listing['user_id'], listing['category']) != (user_id, request.args.get('category')):
+            return jsonify({"message": "The cursor belongs to another user or category."}), 400
+        variant = listing['variant']
+        if variant is not None and model_holder.current() is not None:
+            _, variant_model = experiment.variant_model(user_id, model_holder.current())
+            experiment.record(variant, variant_model, listing['ranked'][offset:offset + limit],
+                              degraded=listing['degraded'])
+        return with_variant(page_response(listing['ranked'], token, offset, limit, listing['degraded']), variant)
 
+    model, error = request_model()
+    if error:
+        return error
+    
+    # Per-category models take no part in the experiment.
+    variant = None
+    if experiment is not None and not request.args.get('category'):
+        variant, model = experiment.variant_model(user_id, model)
+    
+    allowed, filter_key = item_filter_mask(model, request.args)
+    diversity = min(max(request.args.get('diversity', DEFAULT_DIVERSITY, type=float), 0.0), 1.0)
+    explain = request.args.get('explain', 'false').lower() == 'true'
+    with admission.slot('recommendations') as admitted:
+        if not admitted:
+            if variant is not None:
+                experiment.record(variant, model, model.popular_items(allowed=allowed), degraded='overloaded')
+            return with_variant(overloaded_response(model, allowed=allowed), variant)
+        num_recommendations = RANKED_LIST_DEPTH if paged else DEFAULT_PAGE_SIZE
+        scoring_started = time.perf_counter()
+        recommendations, degraded = recommendation_flight.do(
+            (model.version, user_id, filter_key, diversity, num_recommendations, explain),
+            get_recommendations_for_user, user_id, num_recommendations,
+            model=model, deadline=deadline, allowed=allowed, diversity=diversity, explain=explain)
+    scoring_seconds = time.perf_counter() - scoring_started
+    if variant is not None:
+        shown = recommendations[offset:offset + limit] if paged else recommendations
+        experiment.record(variant, model, shown, scoring_seconds, degraded)
+    # Only plain, complete answers are comparable: the candidate scores without
+    # item filters, re-ranking or a deadline. With item filters loaded even the
+    # default request drops blocked and out-of-stock products, so nothing is compared.
+    scorer = shadow_scorer
+    if (scorer is not None and recommendations and not degraded and diversity == 0
+            and allowed is None and not request.args.get('category')):
+        scorer.offer(user_id, model.version, recommendations, scoring_seconds, variant=variant)
+
+    if recommendations and paged:
+        token = ranked_lists.put(recommendations, user_id=user_id, category=request.args.get('category'),
+                                 degraded=degraded, variant=variant)
+        return with_variant(page_response(recommendations, token, offset, limit, degraded), variant)
     if recommendations:
-        formatted_recommendations = []
-        for prod_id, score in recommendations:
-            product_info = PRODUCT_CATALOG.get(prod_id, {
-                'name': 'Product ' + prod_id,
-                'image_url': 'https://via.placeholder.com/150'
-            })
-            formatted_recommendations.append({
-                'product_id': prod_id,
-                'name': product_info['name'],
-                'image_url': product_info['image_url'],
-                'score': float(score)
-            })
-        return jsonify(formatted_recommendations)
+        response = jsonify(format_products(recommendations))
+        if degraded:
+            response.headers['X-Recommendations-Degraded'] = degraded
+        return with_variant(response, variant)
     else:
-        return jsonify({"message": f"No recommendations found for user ID '{user_id}'."}), 404
+        return with_variant(jsonify({"message": f"No recommendations found for user ID '{user_id}'."}), variant), 404
+
+@app.route('/similar/<product_id>', methods=['GET'])
+def get_similar_products(product_id):
+    """
+    API endpoint for "customers also liked" on a product page.
+    Answered straight from the precomputed neighbour index.
+    """
+    model, error = request_model()
+    if error:
+        return error
+    
+    num_similar, error = _num_similar(request.args.get('n', type=int), model)
+    if error:
+        return error
+    with admission.slot('similar') as admitted:
+        if not admitted:
+            return overloaded_response()
+        similar = model.similar_items(product_id, num_similar)
+    if similar is None:
+        return jsonify({"message": f"Product ID '{product_id}' not found in the model."}), 404
+    return jsonify(format_products(similar))
+
+@app.route('/similar', methods=['GET', 'POST'])
+def get_similar_products_batch():
+    """
+    Multi-get variant of /similar/<product_id>. Takes ?product_ids=a,b,c or a
+    JSON body {"product_ids": [...], "n": 10}; unknown products map to null.
+    """
+    model, error = request_model()
+    if error:
+        return error
+    
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        product_ids = body.get('product_ids') or []
+        num_similar, error = _num_similar(body.get('n'), model)
+    else:
+        product_ids = [product_id for product_id in request.args.get('product_ids', '').split(',') if product_id]
+        num_similar, error = _num_similar(request.args.get('n', type=int), model)
+    if error:
+        return error
+    if not product_ids:
+        return jsonify({"message": "No product IDs given."}), 400
+    
+    with admission.slot('similar') as admitted:
+        if not admitted:
+            return overloaded_response()
+        results = model.similar_items_many(product_ids, num_similar)
+    return jsonify({product_id: None if similar is None else format_products(similar)
+                    for product_id, similar in results.items()})
+
+@app.route('/recommendations/session', methods=['GET', 'POST'])
+def get_session_recommendations():
+    """
+    API endpoint for anonymous sessions and carts, scored from the products alone.
+    Takes ?product_ids=a,b,c or a JSON body such as
+    {"product_ids": [...], "weights": [...], "ages": [...], "half_life": 3, "n": 5}.
+    """
+    model, error = request_model()
+    if error:
+        return error
+    
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+    else:
+        body = {
+            'product_ids': [product_id for product_id in request.args.get('product_ids', '').split(',') if product_id],
+            'half_life': request.args.get('half_life', type=float),
+            'n': request.args.get('n', type=int),
+        }
+    product_ids = body.get('product_ids') or []
+    if not product_ids:
+        return jsonify({"message": "No product IDs given."}), 400
+    if not isinstance(product_ids, list) or not all(isinstance(product_id, str) for product_id in product_ids):
+        return jsonify({"message": "'product_ids' must be a list of product IDs."}), 400
+    # A JSON body can carry any type, so everything is checked before it is scored.
+    num_recommendations = body.get('n')
+    if num_recommendations is not None and (not isinstance(num_recommendations, int)
+                                            or isinstance(num_recommendations, bool)):
+        return jsonify({"message": "'n' must be an integer."}), 400
+    num_recommendations = num_recommendations if num_recommendations and num_recommendations > 0 else 5
+    for field in ('weights', 'ages'):
+        values = body.get(field)
+        if values is None:
+            continue
+        if not isinstance(values, list) or len(values) != len(product_ids):
+            return jsonify({"message": f"'{field}' must have one entry per product ID."}), 400
+        if not all(_is_number(value) for value in values):
+            return jsonify({"message": f"'{field}' must be numbers."}), 400
+    if body.get('half_life') is not None and not _is_number(body['half_life']):
+        return jsonify({"message": "'half_life' must be a number."}), 400
+    
+    allowed, _ = item_filter_mask(model, request.args)
+    with admission.slot('session') as admitted:
+        if not admitted:
+            return overloaded_response(model, num_recommendations, allowed)
+        recommendations = model.recommend_for_items(
+            product_ids, weights=body.get('weights'), ages=body.get('ages'), half_life=body.get('half_life'),
+            num_recommendations=num_recommendations, allowed=allowed,
+            explain=bool(body.get('explain')) or request.args.get('explain', 'false').lower() == 'true')
+    if not recommendations:
+        return jsonify({"message": "None of the given products are in the model."}), 404
+    return jsonify(format_products(recommendations))
 
 # --- NEW API ENDPOINT ---
 @app.route('/users', methods=['GET'])
@@ -156,18 +598,150 @@ def get_valid_users():
     """
     API endpoint to get a list of all user IDs in the current in-memory model.
     """
-    if user_item_matrix is None:
-        return jsonify({"message": "Model not loaded."}), 503 # Service Unavailable
+    model, error = request_model()
+    if error:
+        return error
     
-    user_ids = user_item_matrix.columns.tolist()
-    return jsonify(user_ids)
+    with admission.slot('users') as admitted:
+        if not admitted:
+            return overloaded_response()
+        return jsonify(model.user_ids.tolist())
 
-if __name__ == '__main__':
-    processed_data_file = r'D:\Datasets\processed_ecommerce_data.csv'
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    API endpoint with serving counters, e.g. how many requests were coalesced.
+    """
+    return jsonify({
+        'recommendation_single_flight': recommendation_flight.stats(),
+        'admission': admission.stats(),
+        'ranked_lists_cached': len(ranked_lists),
+        'model_registry': None if model_registry is None else model_registry.stats(),
+        'experiment': None if experiment is None else experiment.stats(),
+        'shadow': None if shadow_scorer is None else shadow_scorer.stats(),
+    })
 
-    if build_recommender_model(processed_data_file):
-        print("\nStarting Flask API...")
-        os.environ['FLASK_APP'] = 'api.py'
-        app.run(host='0.0.0.0', port=5000, debug=True)
-    else:
-        print("\nError: Model failed to build. API will not start.")
\ No newline at end of file
+@app.route('/healthz', methods=['GET'])
+def get_health():
+    """
+    Liveness: the process is up and answering, whether or not a model is loaded.
+    """
+    return jsonify({"status": "ok", "uptime_seconds": round(time.time() - started_at, 1)})
+
+@app.route('/readyz', methods=['GET'])
+def get_readiness():
+    """
+    Readiness: 200 once a checked and warmed-up model is serving, 503 before that.
+    Reports the progress of the current load either way.
+    """
+    model = model_holder.current()
+    status = {
+        "ready": model is not None,
+        "model_version": None if model is None else model.version,
+        "load": {**load_progress, 'seconds': round(time.time() - load_progress['since'], 1)},
+        "reload": model_holder.reload_status,
+    }
+    return jsonify(status), 200 if model is not None else 503
+
+# --- ADMIN ENDPOINTS ---
+def _admin_denied():
+    if not ADMIN_TOKEN:
+        return jsonify({"message": "Admin endpoints are disabled; set RECOMMENDER_ADMIN_TOKEN to enable them."}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"message": "Admin token missing or wrong."}), 403
+    return None
+
+def _allowed_source(source):
+    # Only paths inside MODEL_LOCATIONS, after resolving links and "..".
+    path = os.path.realpath(source)
+    for location in MODEL_LOCATIONS:
+        location = os.path.realpath(location)
+        if os.path.commonpath([path, location]) == location:
+            return True
+    return False
+
+@app.route('/admin/model', methods=['GET'])
+def get_model_status():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify({**model_holder.versions(), 'reload': model_holder.reload_status})
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_model():
+    """
+    Builds or loads a new model in the background and swaps it in once it passes
+    its checks. Body: {"source": <model directory or data CSV>}, default MODEL_SOURCE.
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    
+    source = (request.get_json(silent=True) or {}).get('source') or MODEL_SOURCE
+    if not isinstance(source, str) or (source != MODEL_SOURCE and not _allowed_source(source)):
+        return jsonify({"message": "The source must be under one of the configured model locations."}), 400
+    if not model_holder.reload_in_background(lambda: load_serving_model(source), on_swap=on_model_swap):
+        return jsonify({"message": "A reload is already running."}), 409
+    return jsonify({"message": f"Reloading model from {source}."}), 202
+
+@app.route('/admin/rollback', methods=['POST'])
+def rollback_model():
+    denied = _admin_denied()
+    if denied:
+        return denied
+    
+    model = model_holder.rollback()
+    if model is None:
+        return jsonify({"message": "No previous model to roll back to."}), 409
+    on_model_swap(model)
+    return jsonify(model_holder.versions())
+
+@app.route('/admin/stock', methods=['POST'])
+def update_stock():
+    """
+    Marks products in or out of stock for the serving model's filters without a
+    reload. Body: {"product_ids": [...], "in_stock": false}.
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    
+    model = model_holder.current()
+    if model is None or model.item_filters is None:
+        return jsonify({"message": "No item filters loaded."}), 409
+    body = request.get_json(silent=True) or {}
+    if not body.get('product_ids') or not isinstance(body.get('in_stock'), bool):
+        return jsonify({"message": "Give 'product_ids' and a boolean 'in_stock'."}), 400
+    updated = model.item_filters.update_stock(body['product_ids'], body['in_stock'])
+    return jsonify({"updated": updated})
+
+@app.route('/admin/shadow', methods=['POST'])
+def update_shadow():
+    """
+    Starts or replaces shadow scoring. Body: {"source": <model directory>,
+    "sample_rate": 0.05}; {"source": null} stops it.
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    
+    body = request.get_json(silent=True) or {}
+    source = body.get('source')
+    if source and (not isinstance(source, str) or not _allowed_source(source)):
+        return jsonify({"message": "The source must be under one of the configured model locations."}), 400
+    if source and not os.path.isdir(source):
+        return jsonify({"message": f"No model directory at {source}."}), 400
+    start_shadow(source, float(body.get('sample_rate', SHADOW_SAMPLE_RATE)))
+    return jsonify({"shadow": None if shadow_scorer is None else shadow_scorer.stats()})
+
+if __name__ == '__main__':
+    # The port is bound right away and the model loads in the background; until
+    # it is ready, /readyz answers 503 and the model endpoints answer 503.
+    model_holder.reload_in_background(lambda: load_serving_model(MODEL_SOURCE), on_swap=on_model_swap)
+    if SHADOW_MODEL_PATH:
+        start_shadow(SHADOW_MODEL_PATH)
+    
+    print("\nStarting Flask API...")
+    os.environ['FLASK_APP'] = 'api.py'
+    # The Werkzeug reloader would run this whole module, model load included, a second time.
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
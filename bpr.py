@@ -0,0 +1,275 @@
+# bpr.py
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from factor_model import save_factors
+from shared_arrays import attach_array, share_array
+
+# Triples (user, product, sampled negative product) per vectorised SGD step.
+BATCH_SIZE = 4096
+
+# Times a sampled negative that the user actually interacted with is drawn again.
+# Whatever still clashes after that is left out of the step.
+NEGATIVE_SAMPLING_ROUNDS = 3
+
+# Negatives scored against each held-out product for the validation AUC.
+VALIDATION_NEGATIVES = 100
+
+# Validation users scored at once; bounds the memory of the AUC computation.
+VALIDATION_CHUNK_USERS = 2048
+
+
+# --- Sampling ---
+
+def _is_positive(users, items, positive_keys, n_items):
+    # positive_keys: sorted user * n_items + item of every known interaction.
+    keys = users.astype(np.int64) * n_items + items
+    positions = np.minimum(np.searchsorted(positive_keys, keys), len(positive_keys) - 1)
+    return positive_keys[positions] == keys
+
+
+def sample_negatives(users, n_items, positive_keys, rng):
+    """
+    One uniformly drawn product per user that the user has not interacted with.
+    Returns (negatives, valid); valid is False where every redraw still hit a
+    product of the user.
+    """
+    negatives = rng.integers(n_items, size=len(users))
+    clash = _is_positive(users, negatives, positive_keys, n_items)
+    for _ in range(NEGATIVE_SAMPLING_ROUNDS):
+        if not clash.any():
+            break
+        negatives[clash] = rng.integers(n_items, size=int(clash.sum()))
+        clash[clash] = _is_positive(users[clash], negatives[clash], positive_keys, n_items)
+    return negatives, ~clash
+
+
+def split_validation(user_items, max_users, rng):
+    """
+    Leave-one-out split: one random interaction of up to max_users users with
+    at least two is held out. Returns the training (users, items) pairs and the
+    validation (users, items) pairs.
+    """
+    indptr, indices = np.asarray(user_items.indptr), np.asarray(user_items.indices)
+    counts = np.diff(indptr)
+    eligible = np.flatnonzero(counts >= 2)
+    if len(eligible) > max_users:
+        eligible = np.sort(rng.choice(eligible, max_users, replace=False))
+    held = indptr[eligible] + (rng.random(len(eligible)) * counts[eligible]).astype(np.int64)
+
+    users = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+    train = np.ones(len(indices), dtype=bool)
+    train[held] = False
+    return users[train], indices[train].astype(np.int32), eligible.astype(np.int32), indices[held].astype(np.int32)
+
+
+# --- Lock-free training workers ---
+# The factor arrays live in shared memory. Every worker applies its updates
+# straight to them without locks (Hogwild): two workers rarely touch the same
+# row at the same time, and a lost update now and then does not hurt SGD.
+
+_worker_state = {}
+
+
+def _init_worker(specs):
+    segments = []
+    _worker_state.clear()
+    _worker_state['segments'] = segments
+    for name, spec in specs.items():
+        _worker_state[name] = attach_array(spec, segments)
+    return _worker_state
+
+
+def _train_slice(seed, num_samples, learning_rate, regularization, batch_size):
+    """
+    num_samples SGD steps on the BPR objective, drawn in batches: a random
+    training interaction (user, positive) and a sampled negative per step.
+    Returns the summed loss and the number of steps taken.
+    """
+    state = _worker_state
+    user_factors, item_factors, item_bias = state['user_factors'], state['item_factors'], state['item_bias']
+    n_items = len(item_bias)
+    rng = np.random.default_rng(seed)
+    loss, steps = 0.0, 0
+    for start in range(0, num_samples, batch_size):
+        picked = rng.integers(len(state['train_users']), size=min(batch_size, num_samples - start))
+        users, positives = state['train_users'][picked], state['train_items'][picked]
+        negatives, valid = sample_negatives(users, n_items, state['positive_keys'], rng)
+        users, positives, negatives = users[valid], positives[valid], negatives[valid]
+
+        user_vectors = user_factors[users]
+        difference = item_factors[positives] - item_factors[negatives]
+        margin = item_bias[positives] - item_bias[negatives] + np.einsum('ij,ij->i', user_vectors, difference)
+        # sigmoid(-margin): the gradient weight of each triple, written so it cannot overflow.
+        weight = 0.5 * (1 - np.tanh(margin / 2))
+        loss += float(np.logaddexp(0, -margin).sum())
+        steps += len(users)
+
+        # np.add.at, so a user or product drawn twice in a batch gets both updates.
+        np.add.at(user_factors, users,
+                  learning_rate * (weight[:, None] * difference - regularization * user_vectors))
+        np.add.at(item_factors, positives,
+                  learning_rate * (weight[:, None] * user_vectors - regularization * item_factors[positives]))
+        np.add.at(item_factors, negatives,
+                  learning_rate * (-weight[:, None] * user_vectors - regularization * item_factors[negatives]))
+        np.add.at(item_bias, positives, learning_rate * (weight - regularization * item_bias[positives]))
+        np.add.at(item_bias, negatives, learning_rate * (-weight - regularization * item_bias[negatives]))
+    return loss, steps
+
+
+# --- Validation ---
+
+def validation_auc(user_factors, item_factors, item_bias, users, held_items, negatives, valid):
+    """
+    Share of (held-out product, sampled negative) pairs the factors rank the
+    right way round, ties counting half.
+    """
+    right, pairs = 0.0, int(valid.sum())
+    for start in range(0, len(users), VALIDATION_CHUNK_USERS):
+        chunk = slice(start, start + VALIDATION_CHUNK_USERS)
+        user_vectors = user_factors[users[chunk]]
+        positive = np.einsum('ij,ij->i', user_vectors, item_factors[held_items[chunk]]) + item_bias[held_items[chunk]]
+        negative = np.einsum('if,isf->is', user_vectors, item_factors[negatives[chunk]]) + item_bias[negatives[chunk]]
+        right += float(((positive[:, None] > negative) * valid[chunk]).sum())
+        right += 0.5 * float(((positive[:, None] == negative) * valid[chunk]).sum())
+    return right / pairs if pairs else 0.0
+
+
+# --- Training ---
+
+def train_bpr(user_items, num_factors=64, learning_rate=0.05, regularization=0.01, max_epochs=50, patience=3,
+              workers=1, batch_size=BATCH_SIZE, validation_users=10000, seed=42):
+    """
+    Bayesian personalised ranking on implicit feedback: every interaction in
+    the user x item matrix is a positive, whatever its rating, and the model
+    learns to score it above products the user did not interact with.
+
+    One epoch makes as many SGD steps as there are training interactions,
+    split over `workers` processes that update the shared factors lock-free.
+    After each epoch the AUC on a leave-one-out validation split is measured;
+    training stops after `patience` epochs without improvement and the best
+    epoch's factors are returned as (user_factors, item_factors, item_bias, history).
+    """
+    rng = np.random.default_rng(seed)
+    n_users, n_items = user_items.shape
+    train_users, train_items, held_users, held_items = split_validation(user_items, validation_users, rng)
+    all_users = np.repeat(np.arange(n_users, dtype=np.int64), np.diff(np.asarray(user_items.indptr)))
+    positive_keys = np.sort(all_users * n_items + np.asarray(user_items.indices))
+    del all_users
+
+    negatives, valid = sample_negatives(np.repeat(held_users, VALIDATION_NEGATIVES), n_items, positive_keys, rng)
+    negatives = negatives.reshape(-1, VALIDATION_NEGATIVES)
+    valid = valid.reshape(-1, VALIDATION_NEGATIVES)
+    print(f"BPR: {len(train_users)} training interactions, {len(held_users)} held out for validation, "
+          f"{n_users} users x {n_items} items, {num_factors} factors, {workers} worker(s).")
+
+    segments = []
+    pool = None
+    try:
+        specs = {
+            'user_factors': share_array(rng.normal(0, 0.1, (n_users, num_factors)).astype(np.float32), segments),
+            'item_factors': share_array(rng.normal(0, 0.1, (n_items, num_factors)).astype(np.float32), segments),
+            'item_bias': share_array(np.zeros(n_items, dtype=np.float32), segments),
+            'train_users': share_array(train_users, segments),
+            'train_items': share_array(train_items, segments),
+            'positive_keys': share_array(positive_keys, segments),
+        }
+        del train_users, train_items, positive_keys
+        # This process maps the same arrays: it measures the AUC, and trains
+        # itself when there is a single worker.
+        state = _init_worker(specs)
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs,))
+
+        steps_per_worker = -(-len(state['train_users']) // workers)
+        best, history = None, []
+        for epoch in range(1, max_epochs + 1):
+            started = time.time()
+            seeds = [int(seed) for seed in rng.integers(2**62, size=workers)]
+            if pool is None:
+                results = [_train_slice(seeds[0], steps_per_worker, learning_rate, regularization, batch_size)]
+            else:
+                futures = [pool.submit(_train_slice, worker_seed, steps_per_worker, learning_rate, regularization,
+                                       batch_size) for worker_seed in seeds]
+                results = [future.result() for future in futures]
+            loss = sum(result[0] for result in results) / max(1, sum(result[1] for result in results))
+            auc = validation_auc(state['user_factors'], state['item_factors'], state['item_bias'],
+                                 held_users, held_items, negatives, valid)
+            history.append({'epoch': epoch, 'loss': round(loss, 6), 'validation_auc': round(auc, 6),
+                            'seconds': round(time.time() - started, 2)})
+            print(f"Epoch {epoch}: loss {loss:.4f}, validation AUC {auc:.4f} ({time.time() - started:.1f}s)")
+
+            if best is None or auc > best['validation_auc']:
+                best = {'epoch': epoch, 'validation_auc': auc, 'user_factors': state['user_factors'].copy(),
+                        'item_factors': state['item_factors'].copy(), 'item_bias': state['item_bias'].copy()}
+            elif epoch - best['epoch'] >= patience:
+                print(f"Validation AUC has not improved for {patience} epochs; stopping.")
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        # The arrays mapped here must be gone before their segments can be closed.
+        attached = _worker_state.pop('segments', [])
+        _worker_state.clear()
+        state = None
+        for segment in attached + segments:
+            segment.close()
+        for segment in segments:
+            segment.unlink()
+
+    print(f"Best validation AUC {best['validation_auc']:.4f} after epoch {best['epoch']}.")
+    return best['user_factors'], best['item_factors'], best['item_bias'], history
+
+
+def load_interactions(source):
+    """
+    The user x item matrix and the user and item ids to train on: from a saved
+    model directory (the factors then line up with that model and can be served
+    on top of it), or from a processed data CSV.
+    """
+    if os.path.isdir(source):
+        from recommender_model import load_model
+
+        model = load_model(source)
+        return model.user_items, model.user_ids, model.item_ids, model.version
+    import pandas as pd
+    from neighbours import build_interaction_matrix
+
+    matrix, item_ids, user_ids = build_interaction_matrix(pd.read_csv(source))
+    return matrix.T.tocsr(), user_ids, item_ids, None
+
+
+# --- Main entry point ---
+# e.g. python bpr.py D:\Datasets\recommender_model D:\Datasets\bpr_factors --workers 8
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train BPR factors on implicit feedback.")
+    parser.add_argument('source', help="saved model directory or processed data CSV")
+    parser.add_argument('out_dir')
+    parser.add_argument('--factors', type=int, default=64)
+    parser.add_argument('--learning-rate', type=float, default=0.05)
+    parser.add_argument('--regularization', type=float, default=0.01)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--patience', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--validation-users', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    user_items, user_ids, item_ids, model_version = load_interactions(args.source)
+    user_factors, item_factors, item_bias, history = train_bpr(
+        user_items, args.factors, args.learning_rate, args.regularization, args.epochs, args.patience,
+        args.workers, args.batch_size, args.validation_users, args.seed)
+    version = save_factors(args.out_dir, user_ids, item_ids, user_factors, item_factors, item_bias, info={
+        'trained_from': args.source,
+        'model_version': model_version,
+        'learning_rate': args.learning_rate,
+        'regularization': args.regularization,
+        'history': history,
+    })
+    print(f"--- Saved BPR factors {version} to {args.out_dir} ---")
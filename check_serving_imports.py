@@ -0,0 +1,52 @@
+# check_serving_imports.py
+
+import json
+import os
+import subprocess
+import sys
+
+# Modules only model building needs. Importing the API must not load any of them.
+BUILD_ONLY_MODULES = ('pandas', 'scipy', 'sklearn', 'requests')
+
+# Generous ceiling for `import api` in a fresh interpreter, in seconds.
+MAX_IMPORT_SECONDS = 1.0
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import api
+elapsed = time.perf_counter() - started
+print(json.dumps({'elapsed': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def check_serving_imports(max_seconds=MAX_IMPORT_SECONDS):
+    """
+    Imports the API in a fresh interpreter and returns a list of problems:
+    build-only modules it pulled in, or an import slower than max_seconds.
+    """
+    result = subprocess.run([sys.executable, '-c', _PROBE % (BUILD_ONLY_MODULES,)],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        return [f"import api failed:\n{result.stderr}"]
+    # Anything api prints while importing comes first; the probe's report is the last line.
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"import api took {report['elapsed']:.3f}s")
+
+    problems = []
+    if report['loaded']:
+        problems.append(f"import api loaded build-only modules: {', '.join(report['loaded'])}")
+    if report['elapsed'] > max_seconds:
+        problems.append(f"import api took {report['elapsed']:.3f}s, more than {max_seconds}s")
+    return problems
+
+
+# --- Main entry point ---
+# Run in CI or before a release: exits non-zero if the serving import path got heavy again.
+if __name__ == "__main__":
+    problems = check_serving_imports()
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("Serving import path is lean.")
+    sys.exit(1 if problems else 0)
@@ -1,14 +1,31 @@
 # data_preprocessing.py
 
 import pandas as pd
-import requests # Keep this for potential future download functionality if needed
 import os # Keep this for path manipulation if needed
 
-def load_and_preprocess_data(file_path):
+from dedup import deduplicate_pairs
+
+def deduplicate_ratings(df, keep='latest'):
+    """
+    Leaves one row per (user, product) pair. keep='latest' keeps the most recent
+    rating, 'max' the highest and 'mean' their average; the other columns come
+    from the most recent row. Runs as one sort-and-unique pass on integer codes.
+    """
+    user_codes, _ = pd.factorize(df['user_id'])
+    product_codes, product_ids = pd.factorize(df['product_id'])
+    _, _, ratings, latest = deduplicate_pairs(user_codes, product_codes, df['rating'].to_numpy(),
+                                              len(product_ids), times=df['timestamp'].to_numpy(), keep=keep)
+    deduplicated = df.iloc[latest].copy()
+    deduplicated['rating'] = ratings
+    return deduplicated
+
+def load_and_preprocess_data(file_path, duplicates='latest'):
     """
     Loads e-commerce interaction data and performs basic preprocessing.
     Assumes CSV file with no header and the four columns in the order:
     'user_id', 'product_id', 'rating', and 'timestamp'.
+    A user who rated a product more than once keeps one rating, chosen by
+    `duplicates` ('latest', 'max' or 'mean'; see deduplicate_ratings).
     """
     print(f"Loading data from: {file_path}")
 
@@ -51,6 +68,13 @@ def load_and_preprocess_data(file_path):
     df.dropna(subset=['timestamp'], inplace=True) # Drop rows where timestamp couldn't be converted
     print(f"\nData types after timestamp conversion:\n{df.dtypes}")
 
+    # Repeated ratings of the same product by the same user are resolved here, so
+    # the counts below and the model's matrix see each (user, product) pair once.
+    rows_before_dedup = len(df)
+    df = deduplicate_ratings(df, keep=duplicates)
+    if rows_before_dedup != len(df):
+        print(f"\nResolved {rows_before_dedup - len(df)} repeated ratings of the same product (kept: {duplicates}).")
+
 
     # For large datasets, it's common to only consider users/products with a minimum number of interactions
     # This helps with data sparsity and reduces computation. Let's set a threshold.
@@ -0,0 +1,33 @@
+# dedup.py
+
+import numpy as np
+
+
+def deduplicate_pairs(rows, cols, values, n_cols, times=None, keep='mean'):
+    """
+    Reduces (row, col, value) triples to one per (row, col) pair with a single
+    sort and unique pass over the keys row * n_cols + col.
+
+    keep='mean' averages repeated values, 'max' keeps the largest and 'latest'
+    the one with the largest time (the last one given, without times). Means
+    come back as float64, so averaged integer ratings keep their fraction.
+    Returns rows, cols and values sorted by (row, col), which is CSR order, and
+    for every pair the input position of its latest entry.
+    """
+    if keep not in ('mean', 'max', 'latest'):
+        raise ValueError(f"keep must be 'mean', 'max' or 'latest', not {keep!r}")
+    keys = np.asarray(rows, dtype=np.int64) * n_cols + np.asarray(cols, dtype=np.int64)
+    order = np.argsort(keys, kind='stable') if times is None else np.lexsort((times, keys))
+    keys, values = keys[order], np.asarray(values)[order]
+    if len(keys) == 0:
+        return keys, keys.copy(), values, order
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    if keep == 'mean':
+        values = np.add.reduceat(values, starts, dtype=np.float64) / (ends - starts)
+    elif keep == 'max':
+        values = np.maximum.reduceat(values, starts)
+    else:
+        values = values[ends - 1]
+    keys = keys[starts]
+    return keys // n_cols, keys % n_cols, values, order[ends - 1]
@@ -0,0 +1,117 @@
+# embeddings.py
+
+import argparse
+import json
+import os
+import uuid
+
+import numpy as np
+
+from vector_search import SEARCH_BLOCK_ROWS, quantize_int8
+
+# Dimensions of the truncated SVD when the source has no trained factors.
+DEFAULT_SVD_DIMENSIONS = 64
+
+
+def vectors_from_factors(directory):
+    """
+    Item and user vectors from factor artifacts (bpr.py), with the item biases.
+    Returns (item_ids, item_vectors, user_ids, user_vectors, item_bias).
+    """
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    return load('item_ids'), load('item_factors'), load('user_ids'), load('user_factors'), load('item_bias')
+
+
+def vectors_from_svd(user_items, dimensions=DEFAULT_SVD_DIMENSIONS, seed=42):
+    """
+    Truncated SVD of the user x item rating matrix, R ~ U S Vt. Items get
+    V * sqrt(S) and users U * sqrt(S), so a user's dot product with an item
+    approximates their rating. Returns (item_vectors, user_vectors) as float32.
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import svds
+
+    matrix = sparse.csr_matrix((np.asarray(user_items.data, dtype=np.float32), np.asarray(user_items.indices),
+                                np.asarray(user_items.indptr)), shape=user_items.shape)
+    dimensions = min(dimensions, min(matrix.shape) - 1)
+    user_basis, singular_values, item_basis = svds(matrix, k=dimensions,
+                                                   v0=np.random.default_rng(seed).random(min(matrix.shape)))
+    # svds returns the singular values in ascending order.
+    order = np.argsort(-singular_values)
+    weights = np.sqrt(singular_values[order])
+    item_vectors = (item_basis[order].T * weights).astype(np.float32)
+    user_vectors = (user_basis[:, order] * weights).astype(np.float32)
+    return item_vectors, user_vectors
+
+
+def export_embeddings(directory, item_ids, item_vectors, user_ids=None, user_vectors=None, item_bias=None,
+                      info=None):
+    """
+    Writes an embeddings directory for vector_search.load_embedding_index:
+    item_vectors.npy (float32, one row per item of item_ids.npy), their norms,
+    the int8 codes and per-dimension scales of the unit-length vectors for
+    quantized search, and optionally user vectors and item biases. Returns
+    the version written to embeddings.json.
+    """
+    os.makedirs(directory, exist_ok=True)
+    item_vectors = np.asarray(item_vectors, dtype=np.float32)
+    norms = np.linalg.norm(item_vectors, axis=1).astype(np.float32)
+    unit = np.empty_like(item_vectors)
+    for start in range(0, len(unit), SEARCH_BLOCK_ROWS):
+        block = slice(start, start + SEARCH_BLOCK_ROWS)
+        unit[block] = item_vectors[block] / np.maximum(norms[block], 1e-12)[:, None]
+    codes, scale = quantize_int8(unit)
+
+    arrays = {
+        'item_ids': np.asarray(item_ids).astype(str),
+        'item_vectors': item_vectors,
+        'item_norms': norms,
+        'item_codes': codes,
+        'item_code_scale': scale,
+    }
+    if user_vectors is not None:
+        arrays['user_ids'] = np.asarray(user_ids).astype(str)
+        arrays['user_vectors'] = np.asarray(user_vectors, dtype=np.float32)
+    if item_bias is not None:
+        arrays['item_bias'] = np.asarray(item_bias, dtype=np.float32)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    # load_embedding_index picks up whichever optional files exist, so any an
+    # earlier export left behind (e.g. BPR item biases under SVD vectors) must go.
+    for name in ('user_ids', 'user_vectors', 'item_bias'):
+        path = os.path.join(directory, name + '.npy')
+        if name not in arrays and os.path.exists(path):
+            os.remove(path)
+
+    version = uuid.uuid4().hex[:12]
+    with open(os.path.join(directory, 'embeddings.json'), 'w') as f:
+        json.dump({'version': version, 'dimensions': int(item_vectors.shape[1]), 'items': len(item_vectors),
+                   **(info or {})}, f, indent=1)
+    print(f"Exported {len(item_vectors)} item vectors of {item_vectors.shape[1]} dimensions to {directory} "
+          f"({item_vectors.nbytes / 2**20:.1f} MiB float32, {codes.nbytes / 2**20:.1f} MiB int8).")
+    return version
+
+
+# --- Main entry point ---
+# e.g. python embeddings.py D:\Datasets\bpr_factors D:\Datasets\embeddings
+#      python embeddings.py D:\Datasets\recommender_model D:\Datasets\embeddings --dimensions 64
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export item vectors for vector search.")
+    parser.add_argument('source', help="factor directory (bpr.py) or saved model directory (truncated SVD)")
+    parser.add_argument('out_dir')
+    parser.add_argument('--dimensions', type=int, default=DEFAULT_SVD_DIMENSIONS, help="SVD dimensions")
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.source, 'item_factors.npy')):
+        item_ids, item_vectors, user_ids, user_vectors, item_bias = vectors_from_factors(args.source)
+        info = {'method': 'factors', 'source': args.source}
+    else:
+        from recommender_model import load_model
+
+        model = load_model(args.source)
+        item_vectors, user_vectors = vectors_from_svd(model.user_items, args.dimensions)
+        item_ids, user_ids, item_bias = model.item_ids, model.user_ids, None
+        info = {'method': 'truncated_svd', 'source': args.source, 'model_version': model.version}
+    export_embeddings(args.out_dir, item_ids, item_vectors, user_ids, user_vectors, item_bias, info)
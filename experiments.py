@@ -0,0 +1,207 @@
+# experiments.py
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from factor_model import load_factors
+from latency_histogram import LatencyHistogram
+
+# Derived variant models kept per experiment: the serving model's and the
+# previous one's, so a rollback or a request still on the old model finds its variants.
+VARIANT_MODELS_KEPT = 2
+
+# Variant options (see parse_variants):
+#   k=<int>               only the k most similar neighbours of every item
+#   min_similarity=<f>    neighbours below this similarity are dropped
+#   neighbours=<dir>      the neighbour index of another build over the same
+#                         items (a save_model directory), memory-mapped
+#   factors=<dir>         score with factors trained over the same users and
+#                         items (bpr.py), memory-mapped; see factor_model.py
+VARIANT_OPTIONS = ('k', 'min_similarity', 'neighbours', 'factors')
+
+
+def parse_variants(spec):
+    """
+    Parses a variant list such as "control=50,k20=25;k=20,strict=25;min_similarity=0.1"
+    into (name, weight, options) tuples. Each variant is name=weight, followed by
+    its options separated by ";". A variant without options serves the model as it is.
+    """
+    variants = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        head, *settings = entry.strip().split(';')
+        name, _, weight = head.partition('=')
+        options = {}
+        for setting in settings:
+            option, _, value = setting.partition('=')
+            if option not in VARIANT_OPTIONS or not value:
+                raise ValueError(f"variant '{name}': unknown or empty option '{setting}'")
+            options[option] = value
+        if not name or float(weight or 0) <= 0:
+            raise ValueError(f"variant '{entry}' needs a name and a positive weight")
+        variants.append((name, float(weight), options))
+    if len({name for name, _, _ in variants}) != len(variants):
+        raise ValueError("variant names must be unique")
+    return variants
+
+
+def derive_variant(model, name, options):
+    """
+    The model of one variant, derived from the serving model. It shares the
+    serving model's id maps and rating matrix; only the neighbour index (or,
+    with factors, the scoring) differs, and a k option is a view of the
+    serving model's index, not a copy.
+    """
+    if not options:
+        return model
+    neighbour_items, neighbour_scores = model.neighbour_items, model.neighbour_scores
+    if 'neighbours' in options:
+        directory = options['neighbours']
+        item_ids = np.load(os.path.join(directory, 'item_ids.npy'), mmap_mode='r')
+        if not np.array_equal(item_ids, model.item_ids):
+            raise ValueError(f"variant '{name}': {directory} was built over other items")
+        neighbour_items = np.load(os.path.join(directory, 'neighbour_items.npy'), mmap_mode='r')
+        neighbour_scores = np.load(os.path.join(directory, 'neighbour_scores.npy'), mmap_mode='r')
+    if 'k' in options:
+        # Neighbours are stored most similar first.
+        k = int(options['k'])
+        neighbour_items, neighbour_scores = neighbour_items[:, :k], neighbour_scores[:, :k]
+    if 'min_similarity' in options:
+        # Dropped neighbours become empty slots; the scores are only read where
+        # the slot holds an item, so they stay shared.
+        neighbour_items = np.where(neighbour_scores >= float(options['min_similarity']), neighbour_items, -1)
+        neighbour_items = neighbour_items.astype(model.neighbour_items.dtype, copy=False)
+    version = f"{model.version}-{name}"
+    if neighbour_items is not model.neighbour_items:
+        model = model.with_neighbours(neighbour_items, neighbour_scores, version)
+    if 'factors' in options:
+        model = load_factors(options['factors'], model, version)
+    return model
+
+
+class _VariantStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.empty = 0
+        self.degraded = {}
+        self.products_shown = 0
+        # Which products this variant has shown, over the item codes of exposed_version.
+        self.exposed = None
+        self.exposed_version = None
+
+    def expose(self, model, product_ids):
+        if self.exposed_version != model.version:
+            self.exposed = np.zeros(len(model.item_ids), dtype=bool)
+            self.exposed_version = model.version
+        # A page of a list ranked before a reload can name products the new model lacks.
+        codes = [model.item_index.get(product_id, -1) for product_id in product_ids]
+        self.exposed[[code for code in codes if code >= 0]] = True
+        self.products_shown += len(product_ids)
+
+    def to_dict(self):
+        distinct = int(self.exposed.sum()) if self.exposed is not None else 0
+        return {
+            'requests': self.requests,
+            'empty': self.empty,
+            'degraded': self.degraded,
+            'latency_ms': self.latency.summary_ms(),
+            'products_shown': self.products_shown,
+            'distinct_products_shown': distinct,
+            'catalog_coverage': round(distinct / len(self.exposed), 6) if self.exposed is not None else 0.0,
+        }
+
+
+class Experiment:
+    """
+    Named model variants served side by side from one process.
+
+    Every user is assigned to one variant by a hash of the experiment name and
+    the user id, so the assignment is the same on every request and every
+    server, and changes only when the name or the weights do. Variant models are
+    derived from the serving model on first use and share its memory (see
+    derive_variant). Latency and exposure are counted per variant.
+    """
+
+    def __init__(self, variants, name='experiment'):
+        self.name = name
+        self.variants = variants
+        weights = np.array([weight for _, weight, _ in variants])
+        self._bounds = np.cumsum(weights) / weights.sum()
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {variant: _VariantStats() for variant, _, _ in variants}
+
+    def assign(self, user_id):
+        """
+        The variant name of a user.
+        """
+        digest = hashlib.blake2b(f"{self.name}:{user_id}".encode(), digest_size=8).digest()
+        point = int.from_bytes(digest, 'big') / 2**64
+        index = min(int(np.searchsorted(self._bounds, point, side='right')), len(self.variants) - 1)
+        return self.variants[index][0]
+
+    def models_for(self, model, strict=False):
+        """
+        The variant models derived from a serving model, by variant name.
+
+        A variant that cannot be derived from this model (e.g. factors trained
+        for another build) raises ValueError when strict; otherwise it is
+        served by the model itself, like a control group, until the next model.
+        """
+        with self._lock:
+            models = self._models.get(model.version)
+            if models is None:
+                models = {}
+                for variant, _, options in self.variants:
+                    try:
+                        models[variant] = derive_variant(model, variant, options)
+                    except ValueError as error:
+                        if strict:
+                            raise
+                        print(f"Experiment variant '{variant}' falls back to model {model.version}: {error}")
+                        models[variant] = model
+                self._models[model.version] = models
+                while len(self._models) > VARIANT_MODELS_KEPT:
+                    self._models.popitem(last=False)
+            else:
+                self._models.move_to_end(model.version)
+            return models
+
+    def variant_model(self, user_id, model):
+        """
+        (variant name, variant model) for a user's request on a serving model.
+        """
+        variant = self.assign(user_id)
+        return variant, self.models_for(model)[variant]
+
+    def record(self, variant, model, recommendations, seconds=None, degraded=None):
+        """
+        Counts a response of a variant: its products, how long it took to score
+        (None for a page served from an already ranked list) and whether it was degraded.
+        """
+        with self._lock:
+            stats = self._stats[variant]
+            stats.requests += 1
+            if seconds is not None:
+                stats.latency.record(seconds * 1e6)
+            if not recommendations:
+                stats.empty += 1
+            if degraded:
+                stats.degraded[degraded] = stats.degraded.get(degraded, 0) + 1
+            stats.expose(model, [recommendation[0] for recommendation in recommendations])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'variants': {
+                    variant: {'weight': weight, 'options': options, **self._stats[variant].to_dict()}
+                    for variant, weight, options in self.variants
+                },
+            }
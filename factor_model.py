@@ -0,0 +1,91 @@
+# factor_model.py
+
+import json
+import os
+import uuid
+
+import numpy as np
+
+from recommender_model import RecommenderModel
+
+# One .npy file per array; see save_factors and load_factors.
+FACTOR_ARRAYS = ('item_ids', 'user_ids', 'user_factors', 'item_factors', 'item_bias')
+
+
+class FactorModel(RecommenderModel):
+    """
+    Serves recommendations from user and item factors (e.g. trained by bpr.py)
+    on top of an item-CF model over the same users and items.
+
+    A user's score for an item is user_factors[user] . item_factors[item] +
+    item_bias[item]. The id maps, the rating matrix (to leave out products the
+    user already has), the item filters and the neighbour index (for /similar
+    and diversity re-ranking) are shared with the item-CF model, not copied.
+    Explanations are not available: a factor score has no per-product parts.
+    """
+
+    def __init__(self, model, user_factors, item_factors, item_bias, version):
+        self.__dict__.update(model.__dict__)
+        self.version = version
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.item_bias = item_bias
+
+    def _rank(self, query, source_items, num_recommendations, allowed=None):
+        scores = self.item_factors @ query + self.item_bias
+        return self._best(np.arange(len(scores)), scores, source_items, num_recommendations, allowed)
+
+    def score_items(self, source_items, weights, num_recommendations=5, allowed=None, explain=False):
+        """
+        Scores every item against the weighted mean of the source items'
+        factors, so a session or cart is folded in as if it were a user.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        query = weights @ self.item_factors[source_items] / max(float(weights.sum()), 1e-12)
+        return self._rank(query, source_items, num_recommendations, allowed)
+
+    def recommend(self, user_id, num_recommendations=5, allowed=None, explain=False):
+        if not self.has_user(user_id):
+            return []
+        rated_items, _ = self.user_ratings(user_id)
+        return self._rank(self.user_factors[self.user_index[user_id]], rated_items, num_recommendations, allowed)
+
+    def recommend_until(self, user_id, deadline, num_recommendations=5, allowed=None, explain=False):
+        # One dot product per item, whatever the length of the user's history.
+        return self.recommend(user_id, num_recommendations, allowed), True
+
+
+def save_factors(directory, user_ids, item_ids, user_factors, item_factors, item_bias, info=None):
+    """
+    Writes factor artifacts as one .npy file per array plus factors.json with
+    the version and whatever training info is given. Returns the version.
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {
+        'item_ids': np.asarray(item_ids).astype(str),
+        'user_ids': np.asarray(user_ids).astype(str),
+        'user_factors': user_factors.astype(np.float32, copy=False),
+        'item_factors': item_factors.astype(np.float32, copy=False),
+        'item_bias': item_bias.astype(np.float32, copy=False),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    version = uuid.uuid4().hex[:12]
+    with open(os.path.join(directory, 'factors.json'), 'w') as f:
+        json.dump({'version': version, 'num_factors': int(user_factors.shape[1]), **(info or {})}, f, indent=1)
+    return version
+
+
+def load_factors(directory, model, version=None, mmap_mode='r'):
+    """
+    A FactorModel from artifacts written by save_factors, on top of `model`.
+    The factors must have been trained over the same user and item ids (train
+    from the model's directory to get them); otherwise ValueError.
+    """
+    arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in FACTOR_ARRAYS}
+    if not (np.array_equal(arrays['item_ids'], model.item_ids) and np.array_equal(arrays['user_ids'], model.user_ids)):
+        raise ValueError(f"{directory}: the factors were trained over other users or items than model {model.version}")
+    if version is None:
+        with open(os.path.join(directory, 'factors.json')) as f:
+            version = json.load(f)['version']
+    return FactorModel(model, arrays['user_factors'], arrays['item_factors'], arrays['item_bias'], version)
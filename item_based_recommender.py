@@ -3,6 +3,12 @@
 import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
+import os
+
+from sampling import plan_sample, sample_users
+
+# Memory the pivot table and the full similarity matrix may use on this machine.
+MEMORY_BUDGET_MB = int(os.environ.get('RECOMMENDER_MEMORY_BUDGET_MB', '1024'))
 
 def build_and_recommend(data_path, num_recommendations=5):
     """
@@ -22,19 +28,26 @@ def build_and_recommend(data_path, num_recommendations=5):
     print(df.head())
     
     # --- VIBE CODING FIX: Sample a smaller portion of the data ---
-    # We will work with a random sample to avoid memory overflow issues
-    # A sample size of 100,000 to 200,000 is usually a good starting point for proof of concept
-    sample_size = 150000 
+    # We will work with a sample to avoid memory overflow issues.
+    # Sampling random rows breaks up user histories and most users then fall under
+    # min_interactions, so we keep whole users. The record budget and the threshold
+    # are sized from the interaction counts to fit MEMORY_BUDGET_MB.
+    plan = plan_sample(df['user_id'].value_counts(), df['product_id'].value_counts(),
+                       MEMORY_BUDGET_MB * 2**20, k_options=(None,))
+    if plan is None:
+        print("Error: The dense similarity matrix does not fit in the configured memory budget.")
+        return None
+    sample_size = plan['row_budget']
+    min_interactions = plan['min_interactions']
     
     print(f"\nProblem-solving! The dataset is too large for a pivot table on this machine.")
-    print(f"Taking a random sample of {sample_size} records to continue building the recommender.")
+    print(f"Sampling whole users up to a budget of {sample_size} records to continue building the recommender.")
     
-    # Use .sample() to get a random subset of the DataFrame
-    df = df.sample(n=sample_size, random_state=42).reset_index(drop=True)
+    df = sample_users(df, row_budget=sample_size, min_interactions=min_interactions,
+                      stratify=True, random_state=42)
     
     # It's good practice to re-filter sparse users/products after sampling
     # to ensure each user/product in the sample has a decent number of ratings
-    min_interactions = 5
     user_counts = df['user_id'].value_counts()
     product_counts = df['product_id'].value_counts()
     
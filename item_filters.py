@@ -0,0 +1,112 @@
+# item_filters.py
+
+import csv
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+# Distinct filter combinations whose masks are kept ready.
+MASK_CACHE_SIZE = 1024
+
+# Regions are bits of a uint64 per item.
+MAX_REGIONS = 64
+
+
+class ItemFilters:
+    """
+    Business rules over the item codes of one model, held as arrays so that a
+    filter combination is a single boolean mask over all items:
+
+    - category_codes: int32 code of each item's category (-1 = none)
+    - in_stock, blocked: one bool per item
+    - region_bits: uint64 per item, bit r set when the item may be shown in region r
+
+    Masks are cached per combination; update_stock() changes availability in
+    place and drops the cached masks.
+    """
+
+    def __init__(self, item_ids, category_codes, categories, in_stock, blocked, region_bits, regions):
+        self.item_ids = item_ids
+        self.category_codes = category_codes
+        self.category_index = {category: code for code, category in enumerate(categories)}
+        self.in_stock = in_stock
+        self.blocked = blocked
+        self.region_bits = region_bits
+        self.region_index = {region: bit for bit, region in enumerate(regions)}
+        self._item_index = {item_id: code for code, item_id in enumerate(item_ids.tolist())}
+        self._lock = threading.Lock()
+        self.mask = lru_cache(maxsize=MASK_CACHE_SIZE)(self._mask)
+
+    def _mask(self, categories=None, region=None, include_out_of_stock=False):
+        """
+        Boolean array over item codes: True for items the request may show.
+        Blocked items are always excluded. categories is a tuple of category
+        names (None = any); unknown categories and regions match nothing.
+        """
+        allowed = ~self.blocked
+        if not include_out_of_stock:
+            allowed &= self.in_stock
+        if categories:
+            wanted = np.zeros(len(self.category_index) + 1, dtype=bool)
+            wanted[[self.category_index[category] for category in categories if category in self.category_index]] = True
+            # Code -1 (no category) indexes the extra last slot, which stays False.
+            allowed &= wanted[self.category_codes]
+        if region is not None:
+            bit = self.region_index.get(region)
+            if bit is None:
+                return np.zeros(len(self.item_ids), dtype=bool)
+            allowed &= (self.region_bits & np.uint64(1 << bit)) != 0
+        allowed.flags.writeable = False
+        return allowed
+
+    def update_stock(self, product_ids, in_stock):
+        """
+        Marks products as in or out of stock. Unknown products are ignored.
+        """
+        codes = [self._item_index[product_id] for product_id in product_ids if product_id in self._item_index]
+        with self._lock:
+            stock = self.in_stock.copy()
+            stock[codes] = in_stock
+            self.in_stock = stock
+            self.mask.cache_clear()
+        return len(codes)
+
+
+def load_item_filters(path, item_ids):
+    """
+    Builds ItemFilters for a model's item_ids from a CSV with a header and the
+    columns product_id, category, in_stock, blocked and regions (separated by
+    "|"; empty = every region). Items missing from the file are in stock, not
+    blocked, uncategorised and shown in every region.
+    """
+    n_items = len(item_ids)
+    item_index = {item_id: code for code, item_id in enumerate(item_ids.tolist())}
+    category_codes = np.full(n_items, -1, dtype=np.int32)
+    in_stock = np.ones(n_items, dtype=bool)
+    blocked = np.zeros(n_items, dtype=bool)
+    region_bits = np.full(n_items, np.iinfo(np.uint64).max, dtype=np.uint64)
+    categories, regions = {}, {}
+
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            code = item_index.get(row['product_id'])
+            if code is None:
+                continue
+            if row.get('category'):
+                category_codes[code] = categories.setdefault(row['category'], len(categories))
+            in_stock[code] = row.get('in_stock', '1').strip().lower() not in ('0', 'false', 'no')
+            blocked[code] = row.get('blocked', '0').strip().lower() in ('1', 'true', 'yes')
+            if row.get('regions'):
+                bits = 0
+                for region in row['regions'].split('|'):
+                    if region not in regions:
+                        if len(regions) == MAX_REGIONS:
+                            raise ValueError(f"{path}: more than {MAX_REGIONS} regions")
+                        regions[region] = len(regions)
+                    bits |= 1 << regions[region]
+                region_bits[code] = bits
+
+    print(f"Loaded item filters for {n_items} items: {len(categories)} categories, {len(regions)} regions, "
+          f"{int((~in_stock).sum())} out of stock, {int(blocked.sum())} blocked.")
+    return ItemFilters(item_ids, category_codes, list(categories), in_stock, blocked, region_bits, list(regions))
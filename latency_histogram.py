@@ -0,0 +1,80 @@
+# latency_histogram.py
+
+import numpy as np
+
+# Percentiles reported by summary_ms().
+REPORT_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds: exact below 256us, and
+    128 sub-buckets per power of two above that, so every recorded value is
+    kept to within 1% however long the run. Histograms from different
+    threads are combined with merge().
+    """
+
+    # 2**8 exact buckets; above them each power of two splits into 2**7 sub-buckets.
+    SUB_BUCKET_BITS = 8
+    # Enough buckets for one hour; anything slower lands in the last bucket.
+    N_BUCKETS = 3584
+
+    def __init__(self):
+        self.counts = np.zeros(self.N_BUCKETS, dtype=np.int64)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value):
+        sub_buckets = 1 << cls.SUB_BUCKET_BITS
+        if value < sub_buckets:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        half = sub_buckets >> 1
+        index = sub_buckets + (shift - 1) * half + ((value >> shift) - half)
+        return min(index, cls.N_BUCKETS - 1)
+
+    @classmethod
+    def _highest_value(cls, index):
+        # Largest latency that maps to the bucket, as HdrHistogram reports it.
+        sub_buckets = 1 << cls.SUB_BUCKET_BITS
+        if index < sub_buckets:
+            return index
+        half = sub_buckets >> 1
+        shift, mantissa = divmod(index - sub_buckets, half)
+        shift += 1
+        return ((mantissa + half + 1) << shift) - 1
+
+    def record(self, microseconds):
+        value = max(0, int(microseconds))
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def value_at_percentile(self, percentile):
+        if self.total == 0:
+            return 0
+        rank = max(1, int(np.ceil(percentile / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._highest_value(index), self.max)
+
+    def summary_ms(self):
+        summary = {f"p{percentile:g}": self.value_at_percentile(percentile) / 1000
+                   for percentile in REPORT_PERCENTILES}
+        summary['max'] = self.max / 1000
+        summary['mean'] = self.sum / self.total / 1000 if self.total else 0
+        return summary
+
+    def buckets(self):
+        """
+        Non-empty buckets as [highest latency in us, count] pairs.
+        """
+        return [[self._highest_value(int(index)), int(self.counts[index])] for index in np.flatnonzero(self.counts)]
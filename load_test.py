@@ -0,0 +1,408 @@
+# load_test.py
+
+import argparse
+import http.client
+import itertools
+import json
+import queue
+import sys
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+from latency_histogram import LatencyHistogram
+
+# Share of synthetic requests per endpoint when --mix is not given.
+DEFAULT_MIX = {'recommendations': 70, 'similar': 25, 'users': 5}
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.status_counts = {}
+
+    def record(self, status, microseconds):
+        self.latency.record(microseconds)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for status, count in other.status_counts.items():
+            self.status_counts[status] = self.status_counts.get(status, 0) + count
+
+    @property
+    def errors(self):
+        # Server errors and requests that got no answer at all. A 404 for an
+        # unknown user is a normal answer and is only listed in status_counts.
+        return sum(count for status, count in self.status_counts.items()
+                   if not isinstance(status, int) or status >= 500)
+
+    def to_dict(self, seconds):
+        total = self.latency.total
+        return {
+            'requests': total,
+            'errors': self.errors,
+            'error_rate': self.errors / total if total else 0,
+            'throughput_rps': total / seconds if seconds else 0,
+            'status_counts': {str(status): count for status, count in sorted(self.status_counts.items(), key=str)},
+            'latency_ms': self.latency.summary_ms(),
+            'histogram_us': self.latency.buckets(),
+        }
+
+
+# --- Traffic: a recorded log or synthetic Zipf traffic ---
+
+def endpoint_of(path):
+    """
+    Name under which a request path is reported, e.g. /similar/B001 -> 'similar'.
+    """
+    path = urlsplit(path).path
+    if path.startswith('/recommendations/session'):
+        return 'session'
+    for endpoint in ('recommendations', 'similar', 'users'):
+        if path == f"/{endpoint}" or path.startswith(f"/{endpoint}/"):
+            return endpoint
+    return 'other'
+
+
+def read_traffic_log(path):
+    """
+    Reads a JSONL traffic log. Every line is one request with either a "path"
+    (e.g. "/similar/B001?n=5") or a full "url", and optionally a "method"
+    (default GET) and a JSON "body".
+    """
+    requests = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            target = entry.get('path') or entry.get('url')
+            if not target:
+                raise ValueError(f"{path}:{line_number}: request has neither 'path' nor 'url'")
+            parts = urlsplit(target)
+            target = parts.path + (f"?{parts.query}" if parts.query else '')
+            requests.append({
+                'endpoint': endpoint_of(target),
+                'method': entry.get('method', 'GET').upper(),
+                'path': target,
+                'body': entry.get('body'),
+            })
+    if not requests:
+        raise ValueError(f"{path} contains no requests")
+    return requests
+
+
+def _zipf_sampler(n, exponent, rng):
+    # Rank r (0-based) is drawn with probability proportional to 1 / (r + 1) ** exponent.
+    cdf = np.cumsum(1.0 / np.arange(1, n + 1) ** exponent)
+    cdf /= cdf[-1]
+    return lambda size: np.minimum(np.searchsorted(cdf, rng.random(size)), n - 1)
+
+
+def synthetic_traffic(user_ids, item_ids, mix=None, exponent=1.1, seed=0, batch=10000):
+    """
+    Endless stream of requests for Zipf-distributed users and products. Both
+    lists should be ordered most popular first; rank 1 gets the most traffic.
+    mix maps endpoint names (recommendations, similar, users) to relative weights.
+    """
+    mix = {endpoint: weight for endpoint, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+    if not item_ids:
+        mix.pop('similar', None)
+    if not user_ids:
+        mix.pop('recommendations', None)
+    if not mix:
+        raise ValueError("nothing to request: no users or products for the chosen mix")
+    rng = np.random.default_rng(seed)
+    endpoints = list(mix)
+    shares = np.array([mix[endpoint] for endpoint in endpoints], dtype=float)
+    draw_user = _zipf_sampler(len(user_ids), exponent, rng) if user_ids else None
+    draw_item = _zipf_sampler(len(item_ids), exponent, rng) if item_ids else None
+
+    while True:
+        chosen = rng.choice(len(endpoints), size=batch, p=shares / shares.sum())
+        users = draw_user(batch) if draw_user else None
+        items = draw_item(batch) if draw_item else None
+        for i, endpoint_number in enumerate(chosen):
+            endpoint = endpoints[endpoint_number]
+            if endpoint == 'recommendations':
+                path = f"/recommendations/{quote(str(user_ids[users[i]]), safe='')}"
+            elif endpoint == 'similar':
+                path = f"/similar/{quote(str(item_ids[items[i]]), safe='')}"
+            else:
+                path = '/users'
+            yield {'endpoint': endpoint, 'method': 'GET', 'path': path, 'body': None}
+
+
+def ids_from_model(model_dir):
+    """
+    User and product ids of a saved model, each ordered by number of interactions, most first.
+    """
+    from recommender_model import load_model
+
+    model = load_model(model_dir)
+    user_items = model.user_items
+    user_counts = np.diff(np.asarray(user_items.indptr))
+    item_counts = np.bincount(np.asarray(user_items.indices), minlength=len(model.item_ids))
+    users = model.user_ids[np.argsort(-user_counts, kind='stable')].tolist()
+    items = model.item_ids[np.argsort(-item_counts, kind='stable')].tolist()
+    return users, items
+
+
+def ids_from_api(base_url, timeout=30, sample_users=20):
+    """
+    User ids from GET /users, and the product ids that come back in the
+    recommendations of a few of those users. Without a saved model at hand
+    this is the only way to find product ids to ask /similar about.
+    """
+    client = _Client(base_url, timeout)
+    status, body = client.request('GET', '/users')
+    if status != 200:
+        raise RuntimeError(f"GET /users answered {status}; is the model loaded?")
+    users = json.loads(body)
+    items = []
+    for user_id in users[:: max(1, len(users) // sample_users)][:sample_users]:
+        status, body = client.request('GET', f"/recommendations/{quote(str(user_id), safe='')}")
+        if status == 200:
+            items.extend(product['product_id'] for product in json.loads(body))
+    client.close()
+    return users, list(dict.fromkeys(items))
+
+
+# --- Running the load ---
+
+class _Client:
+    # One keep-alive connection per worker thread; http.client reconnects by
+    # itself when the server closes it.
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.prefix = parts.path.rstrip('/')
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+def _send(client, request, stats, started=None):
+    # Latency runs from `started` (a perf_counter time, default now) to the end of the response.
+    started = time.perf_counter() if started is None else started
+    try:
+        status, _ = client.request(request['method'], request['path'], request['body'])
+    except Exception as error:
+        status = type(error).__name__
+    elapsed = (time.perf_counter() - started) * 1e6
+    stats.setdefault(request['endpoint'], EndpointStats()).record(status, elapsed)
+
+
+def run_closed_loop(base_url, traffic, concurrency, duration=None, max_requests=None, timeout=10):
+    """
+    Keeps `concurrency` requests in flight: every worker sends its next request
+    as soon as the previous one is answered. Stops after `duration` seconds or
+    `max_requests` requests, whichever comes first.
+    Returns the per-endpoint stats and the elapsed seconds.
+    """
+    traffic = iter(traffic)
+    if max_requests is not None:
+        traffic = itertools.islice(traffic, max_requests)
+    traffic_lock = threading.Lock()
+    deadline = None if duration is None else time.perf_counter() + duration
+    worker_stats = [{} for _ in range(concurrency)]
+
+    def work(stats):
+        client = _Client(base_url, timeout)
+        while deadline is None or time.perf_counter() < deadline:
+            with traffic_lock:
+                request = next(traffic, None)
+            if request is None:
+                break
+            _send(client, request, stats)
+        client.close()
+
+    return _run_workers(work, worker_stats)
+
+
+def run_open_loop(base_url, traffic, rate, duration=None, max_requests=None, concurrency=64, timeout=10, seed=0):
+    """
+    Sends requests on a Poisson schedule of `rate` per second, whether or not
+    earlier ones have been answered. Latency is measured from the scheduled
+    send time, so when the server (or the pool of `concurrency` senders) falls
+    behind, the wait shows up in the results instead of silently lowering the
+    offered load.
+    Returns the per-endpoint stats and the elapsed seconds.
+    """
+    traffic = iter(traffic)
+    if max_requests is not None:
+        traffic = itertools.islice(traffic, max_requests)
+    scheduled = queue.Queue(maxsize=concurrency * 16)
+    rng = np.random.default_rng(seed)
+    worker_stats = [{} for _ in range(concurrency)]
+    stop = object()
+
+    def schedule():
+        start = time.perf_counter()
+        send_at = start
+        for request in traffic:
+            send_at += rng.exponential(1.0 / rate)
+            if duration is not None and send_at - start > duration:
+                break
+            delay = send_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            scheduled.put((send_at, request))
+        for _ in range(concurrency):
+            scheduled.put(stop)
+
+    def work(stats):
+        client = _Client(base_url, timeout)
+        while True:
+            item = scheduled.get()
+            if item is stop:
+                break
+            send_at, request = item
+            # Time spent waiting for a free sender counts as latency.
+            _send(client, request, stats, started=send_at)
+        client.close()
+
+    scheduler = threading.Thread(target=schedule, name='load-schedule', daemon=True)
+    scheduler.start()
+    return _run_workers(work, worker_stats)
+
+
+def _run_workers(work, worker_stats):
+    started = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(stats,), name=f"load-{i}", daemon=True)
+               for i, stats in enumerate(worker_stats)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    merged = {}
+    for stats in worker_stats:
+        for endpoint, endpoint_stats in stats.items():
+            merged.setdefault(endpoint, EndpointStats()).merge(endpoint_stats)
+    return merged, elapsed
+
+
+# --- Reporting ---
+
+def build_results(stats, elapsed, config):
+    """
+    Machine-readable results: per-endpoint and overall counts, error rates,
+    throughput, latency percentiles and the raw histogram buckets.
+    """
+    total = EndpointStats()
+    for endpoint_stats in stats.values():
+        total.merge(endpoint_stats)
+    return {
+        'config': config,
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'duration_seconds': elapsed,
+        'total': total.to_dict(elapsed),
+        'endpoints': {endpoint: stats[endpoint].to_dict(elapsed) for endpoint in sorted(stats)},
+    }
+
+
+def print_results(results):
+    print(f"--- Load test: {results['duration_seconds']:.1f}s ---")
+    header = f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'rps':>9}" + \
+        ''.join(f"{name:>10}" for name in results['total']['latency_ms'])
+    print(header + "   (latency in ms)")
+    rows = list(results['endpoints'].items()) + [('TOTAL', results['total'])]
+    for endpoint, row in rows:
+        print(f"{endpoint:<16}{row['requests']:>10}{row['errors']:>8}{row['throughput_rps']:>9.1f}" +
+              ''.join(f"{value:>10.2f}" for value in row['latency_ms'].values()))
+
+
+def check_thresholds(results, max_p99_ms=None, max_error_rate=None):
+    """
+    Returns a list of threshold violations for the whole run; empty when it passed.
+    """
+    problems = []
+    total = results['total']
+    if max_p99_ms is not None and total['latency_ms']['p99'] > max_p99_ms:
+        problems.append(f"p99 latency {total['latency_ms']['p99']:.2f}ms is above {max_p99_ms}ms")
+    if max_error_rate is not None and total['error_rate'] > max_error_rate:
+        problems.append(f"error rate {total['error_rate']:.2%} is above {max_error_rate:.2%}")
+    if total['requests'] == 0:
+        problems.append("no requests were sent")
+    return problems
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        endpoint, _, weight = part.partition('=')
+        if endpoint not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{endpoint}' (use {', '.join(DEFAULT_MIX)})")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+# --- Main entry point ---
+# e.g. python load_test.py --model-dir D:\Datasets\recommender_model --rate 200 --duration 60 --out results.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for the recommender API.")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="base URL of the API")
+    parser.add_argument('--log', help="JSONL traffic log to replay (cycled until the run ends)")
+    parser.add_argument('--model-dir', help="saved model to take user and product ids from for synthetic traffic; "
+                                            "without it they are fetched from the API")
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX,
+                        help="synthetic endpoint weights, e.g. recommendations=70,similar=25,users=5")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Zipf exponent of synthetic user and product ids")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="requests in flight (closed loop), or senders available (open loop)")
+    parser.add_argument('--rate', type=float, help="open loop: requests per second on a Poisson schedule")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run")
+    parser.add_argument('--requests', type=int, help="stop after this many requests")
+    parser.add_argument('--timeout', type=float, default=10, help="per-request timeout in seconds")
+    parser.add_argument('--out', help="write the results as JSON to this file")
+    parser.add_argument('--max-p99-ms', type=float, help="exit 1 if the overall p99 latency is above this")
+    parser.add_argument('--max-error-rate', type=float, help="exit 1 if the overall error rate is above this")
+    args = parser.parse_args()
+
+    if args.log:
+        traffic = itertools.cycle(read_traffic_log(args.log))
+    else:
+        users, items = ids_from_model(args.model_dir) if args.model_dir else ids_from_api(args.url, args.timeout)
+        print(f"Synthetic traffic over {len(users)} users and {len(items)} products (Zipf {args.zipf}).")
+        traffic = synthetic_traffic(users, items, args.mix, args.zipf, args.seed)
+
+    if args.rate:
+        stats, elapsed = run_open_loop(args.url, traffic, args.rate, args.duration, args.requests,
+                                       args.concurrency, args.timeout, args.seed)
+    else:
+        stats, elapsed = run_closed_loop(args.url, traffic, args.concurrency, args.duration, args.requests,
+                                         args.timeout)
+
+    config = dict(vars(args))
+    config['mode'] = 'open' if args.rate else 'closed'
+    results = build_results(stats, elapsed, config)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    problems = check_thresholds(results, args.max_p99_ms, args.max_error_rate)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,124 @@
+# model_holder.py
+
+import threading
+import time
+
+import numpy as np
+
+
+def check_model(model, sample_users=20):
+    """
+    Sanity checks run on a new model before it may serve traffic.
+    Returns a list of problems; an empty list means the model looks usable.
+    """
+    problems = []
+    n_users, n_items = len(model.user_ids), len(model.item_ids)
+    if n_users == 0 or n_items == 0:
+        return [f"model is empty ({n_users} users, {n_items} items)"]
+    if model.user_items.shape != (n_users, n_items):
+        problems.append(f"user_items shape {model.user_items.shape} does not match {n_users} users x {n_items} items")
+    if model.neighbour_items.shape != model.neighbour_scores.shape or model.neighbour_items.shape[0] != n_items:
+        problems.append("neighbour arrays do not have one row per item")
+    elif model.neighbour_items.size and (model.neighbour_items.min() < -1 or model.neighbour_items.max() >= n_items):
+        problems.append("neighbour index points outside the item range")
+    if not np.isfinite(model.neighbour_scores).all():
+        problems.append("neighbour scores contain NaN or infinity")
+    if problems:
+        return problems
+
+    for user_id in model.user_ids[:: max(1, n_users // sample_users)][:sample_users].tolist():
+        try:
+            model.recommend(user_id)
+        except Exception as error:
+            problems.append(f"scoring user {user_id} failed: {error!r}")
+            break
+    return problems
+
+
+class ModelHolder:
+    """
+    Holds the serving model behind a single reference.
+
+    Request handlers call current() once and use that model for the whole
+    request, so a swap never changes the model under a request in flight: it
+    finishes on the old version while new requests see the new one. Replaced
+    models are kept (up to `history`) so a bad release can be rolled back.
+    """
+
+    def __init__(self, history=2):
+        self._model = None
+        self._previous = []
+        self._history = history
+        self._lock = threading.Lock()
+        self.reload_status = {'state': 'idle'}
+
+    def current(self):
+        return self._model
+
+    def versions(self):
+        return {
+            'current': None if self._model is None else self._model.version,
+            'previous': [model.version for model in reversed(self._previous)],
+        }
+
+    def swap(self, model):
+        """
+        Checks the model and makes it the current one. Returns the list of
+        problems found; the current model is left in place when there are any.
+        """
+        problems = check_model(model)
+        if problems:
+            return problems
+        with self._lock:
+            if self._model is not None:
+                self._previous = (self._previous + [self._model])[-self._history:]
+            self._model = model
+        print(f"Now serving model {model.version}.")
+        return []
+
+    def rollback(self):
+        """
+        Switches back to the model served before the last swap. Returns it, or None when there is none.
+        """
+        with self._lock:
+            if not self._previous:
+                return None
+            self._model = self._previous.pop()
+        print(f"Rolled back to model {self._model.version}.")
+        return self._model
+
+    def reload_in_background(self, load, on_swap=None):
+        """
+        Calls load() on a background thread to build or load a new model, then
+        checks and swaps it in. Returns False if a reload is already running.
+        """
+        with self._lock:
+            if self.reload_status['state'] == 'running':
+                return False
+            self.reload_status = {'state': 'running', 'started': time.time()}
+
+        def run():
+            status = {'finished': None}
+            try:
+                model = load()
+                problems = ['loading returned no model'] if model is None else self.swap(model)
+                if problems:
+                    status.update(state='failed', problems=problems)
+                else:
+                    status.update(state='done', version=model.version)
+            except Exception as error:
+                status.update(state='failed', problems=[repr(error)])
+            if status['state'] == 'done' and on_swap is not None:
+                # The new model is serving by now, whatever happens here.
+                try:
+                    on_swap(model)
+                except Exception as error:
+                    status['on_swap_error'] = repr(error)
+                    print(f"Model {model.version} is serving, but its swap hook failed: {error!r}")
+            status['finished'] = time.time()
+            if status['state'] == 'failed':
+                print(f"Model reload failed, still serving the old model: {status['problems']}")
+            self.reload_status = status
+
+        threading.Thread(target=run, name='model-reload', daemon=True).start()
+        return True
@@ -0,0 +1,152 @@
+# model_registry.py
+
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from recommender_model import MODEL_ARRAYS, load_model
+from single_flight import SingleFlight
+
+# Rough per-id cost of the user and item lookup dicts a loaded model builds.
+BYTES_PER_INDEXED_ID = 150
+
+# Layout of a registry directory:
+#   <root>/<partition>/            one model directory per category or partition,
+#                                  in the save_model layout (build_partition writes it)
+
+
+def partition_bytes(directory):
+    """
+    Memory a loaded partition takes once its arrays are paged in: the array
+    files plus the id lookup dicts.
+    """
+    array_bytes = sum(os.path.getsize(os.path.join(directory, name + '.npy')) for name in MODEL_ARRAYS)
+    n_ids = sum(len(np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+                for name in ('item_ids', 'user_ids'))
+    return array_bytes + n_ids * BYTES_PER_INDEXED_ID
+
+
+def is_complete(directory):
+    """
+    True when directory holds a finished model: every array is written and, for
+    an out-of-core build, its progress file says it is done.
+    """
+    if not all(os.path.exists(os.path.join(directory, name + '.npy')) for name in MODEL_ARRAYS):
+        return False
+    progress_path = os.path.join(directory, 'progress.json')
+    if not os.path.exists(progress_path):
+        return True
+    with open(progress_path) as f:
+        return json.load(f).get('stage') == 'done'
+
+
+class ModelRegistry:
+    """
+    One model per category or partition, each in its own directory under root.
+
+    A partition is memory-mapped on its first request and stays resident while
+    it is used. When the resident partitions would exceed memory_cap_bytes, the
+    least recently used ones are dropped; requests still holding one finish on
+    it, and the next request maps it in again. Concurrent first requests for a
+    partition share one load.
+    """
+
+    def __init__(self, root, memory_cap_bytes, prepare=None):
+        self.root = root
+        self.memory_cap_bytes = memory_cap_bytes
+        self.prepare = prepare
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+        self.hits = 0
+        self.loaded = 0
+        self.evicted = 0
+
+    def partitions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if is_complete(os.path.join(self.root, name)))
+
+    def has_partition(self, partition):
+        # Only plain directory names are partitions, so a request cannot point outside root.
+        return partition in self.partitions()
+
+    def get(self, partition):
+        """
+        The model of a partition, loaded on first use. Raises KeyError for an unknown partition.
+        """
+        with self._lock:
+            entry = self._resident.get(partition)
+            if entry is not None:
+                self._resident.move_to_end(partition)
+                self.hits += 1
+                return entry[0]
+        if not self.has_partition(partition):
+            raise KeyError(partition)
+        return self._loads.do(partition, self._load, partition)
+
+    def _load(self, partition):
+        directory = os.path.join(self.root, partition)
+        size = partition_bytes(directory)
+        model = load_model(directory)
+        if self.prepare is not None:
+            self.prepare(model)
+
+        with self._lock:
+            # Cold partitions make room first; the one just loaded always stays.
+            while self._resident and self.resident_bytes() + size > self.memory_cap_bytes:
+                evicted, _ = self._resident.popitem(last=False)
+                self.evicted += 1
+                print(f"Model registry: evicted partition '{evicted}'.")
+            self._resident[partition] = (model, size)
+            self.loaded += 1
+        print(f"Model registry: loaded partition '{partition}' (model {model.version}, {size / 2**20:.1f} MiB).")
+        return model
+
+    def resident_bytes(self):
+        return sum(size for _, size in self._resident.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'resident': {partition: {'version': model.version, 'bytes': size}
+                             for partition, (model, size) in self._resident.items()},
+                'resident_bytes': self.resident_bytes(),
+                'memory_cap_bytes': self.memory_cap_bytes,
+                'hits': self.hits,
+                'loaded': self.loaded,
+                'evicted': self.evicted,
+            }
+
+
+def build_partition(csv_path, root, partition, k=50, memory_budget_bytes=512 * 2**20):
+    """
+    Builds the model of one partition from its processed data CSV into
+    root/partition. The build is out of core, so a large category never has to
+    fit in memory, and rerunning it after a crash resumes it.
+    """
+    from out_of_core import build_out_of_core
+
+    if os.sep in partition or partition in ('', '.', '..'):
+        raise ValueError(f"invalid partition name {partition!r}")
+    return build_out_of_core(csv_path, os.path.join(root, partition), k, memory_budget_bytes)
+
+
+# --- Main entry point ---
+# e.g. python model_registry.py D:\Datasets\models electronics=D:\Datasets\processed_electronics.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build one model per category into a registry directory.")
+    parser.add_argument('root')
+    parser.add_argument('partitions', nargs='+', metavar='NAME=CSV', help="partition name and its processed data CSV")
+    parser.add_argument('--k', type=int, default=50)
+    parser.add_argument('--memory-budget-mb', type=int, default=512)
+    args = parser.parse_args()
+
+    for spec in args.partitions:
+        name, _, csv_path = spec.partition('=')
+        print(f"--- Building partition '{name}' from {csv_path} ---")
+        build_partition(csv_path, args.root, name, args.k, args.memory_budget_mb * 2**20)
@@ -0,0 +1,192 @@
+# neighbours.py
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from dedup import deduplicate_pairs
+from shared_arrays import attach_array, copy_shared, share_array
+from sizing import SIMILARITY_BLOCK_ROWS
+
+
+def build_interaction_matrix(df):
+    """
+    Builds the sparse item x user rating matrix from the interaction records.
+    Repeated (user, product) ratings are averaged, like pivot_table did; data
+    from data_preprocessing has none left. Returns the matrix together with
+    the product ids of its rows and the user ids of its columns.
+    """
+    item_codes, item_ids = pd.factorize(df['product_id'], sort=True)
+    user_codes, user_ids = pd.factorize(df['user_id'], sort=True)
+    rows, cols, ratings, _ = deduplicate_pairs(item_codes, user_codes, df['rating'].to_numpy(np.float32),
+                                               len(user_ids))
+    ratings = ratings.astype(np.float32, copy=False)
+    # The pairs come out sorted by (item, user), so the CSR arrays are assembled directly.
+    indptr = np.searchsorted(rows, np.arange(len(item_ids) + 1))
+    matrix = sparse.csr_matrix((ratings, cols, indptr), shape=(len(item_ids), len(user_ids)))
+    return matrix, np.asarray(item_ids), np.asarray(user_ids)
+
+
+def normalize_rows(matrix):
+    """
+    Scales every row to unit length, so a dot product of two rows is their cosine similarity.
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags((1 / norms).astype(np.float32)) @ matrix)
+
+
+def _top_k_positions(scores, k):
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _as_neighbours(items, scores):
+    items = items.astype(np.int32)
+    scores = scores.astype(np.float32)
+    empty = scores <= 0
+    items[empty] = -1
+    scores[empty] = 0
+    return items, scores
+
+
+def top_k_from_block(similarities, k, first_row=None):
+    """
+    Keeps the k most similar items for every row of a dense block of similarities.
+    When first_row is given, row i of the block is item first_row + i and the
+    item itself is left out. Zero similarities are left out too; unused slots
+    hold item -1 with score 0.
+    """
+    if first_row is not None:
+        rows = np.arange(similarities.shape[0])
+        similarities[rows, first_row + rows] = 0
+    top, scores = _top_k_positions(similarities, k)
+    return _as_neighbours(top, scores)
+
+
+def merge_top_k(items, scores, more_items, more_scores, k):
+    """
+    Merges two sets of neighbour lists for the same rows, keeping the k best of each row.
+    """
+    items = np.hstack([items, more_items])
+    scores = np.hstack([scores, more_scores])
+    top, top_scores = _top_k_positions(scores, k)
+    return _as_neighbours(np.take_along_axis(items, top, axis=1), top_scores)
+
+
+def neighbours_for_rows(normalized, transposed, start, stop, k=50, block_rows=SIMILARITY_BLOCK_ROWS):
+    """
+    Top-k neighbours of items start..stop-1 against every item, computed
+    block_rows items at a time from the row-normalised matrix and its transpose.
+    """
+    width = min(k, normalized.shape[0])
+    neighbour_items = np.full((stop - start, width), -1, dtype=np.int32)
+    neighbour_scores = np.zeros((stop - start, width), dtype=np.float32)
+    for block_start in range(start, stop, block_rows):
+        block_stop = min(block_start + block_rows, stop)
+        block = (normalized[block_start:block_stop] @ transposed).toarray()
+        rows = slice(block_start - start, block_stop - start)
+        neighbour_items[rows], neighbour_scores[rows] = top_k_from_block(block, k, block_start)
+    return neighbour_items, neighbour_scores
+
+
+def build_neighbour_index(matrix, k=50, block_rows=SIMILARITY_BLOCK_ROWS):
+    """
+    Computes the top-k cosine neighbours of every item (row) of the matrix.
+
+    The similarity matrix is never materialised: rows are processed in blocks of
+    block_rows items, so only a block_rows x n_items slice exists at any time.
+    Returns (neighbour_items, neighbour_scores), both of shape (n_items, k).
+    """
+    normalized = normalize_rows(matrix)
+    transposed = normalized.T.tocsr()
+    return neighbours_for_rows(normalized, transposed, 0, normalized.shape[0], k, block_rows)
+
+
+# --- Parallel build: workers read the matrices from shared memory ---
+# Only segment names travel to the workers, and each worker writes its top-k rows
+# straight into the shared output arrays, so nothing large is ever pickled.
+
+_worker_state = {}
+
+
+def _share_csr(matrix, segments):
+    return {
+        'data': share_array(matrix.data, segments),
+        'indices': share_array(matrix.indices, segments),
+        'indptr': share_array(matrix.indptr, segments),
+        'shape': matrix.shape,
+    }
+
+
+def _attach_csr(spec, segments):
+    arrays = (attach_array(spec['data'], segments), attach_array(spec['indices'], segments),
+              attach_array(spec['indptr'], segments))
+    return sparse.csr_matrix(arrays, shape=spec['shape'], copy=False)
+
+
+def _init_worker(specs):
+    segments = []
+    _worker_state['segments'] = segments
+    _worker_state['normalized'] = _attach_csr(specs['normalized'], segments)
+    _worker_state['transposed'] = _attach_csr(specs['transposed'], segments)
+    _worker_state['items'] = attach_array(specs['items'], segments)
+    _worker_state['scores'] = attach_array(specs['scores'], segments)
+
+
+def _neighbour_block(start, stop, k):
+    items, scores = neighbours_for_rows(_worker_state['normalized'], _worker_state['transposed'],
+                                        start, stop, k, block_rows=stop - start)
+    _worker_state['items'][start:stop] = items
+    _worker_state['scores'][start:stop] = scores
+    return stop - start
+
+
+def build_neighbour_index_parallel(matrix, k=50, block_rows=SIMILARITY_BLOCK_ROWS, workers=None):
+    """
+    Same result as build_neighbour_index, with the row blocks spread over a
+    process pool. The normalised matrix, its transpose and the output arrays
+    live in shared memory that every worker maps instead of receiving a copy.
+    """
+    normalized = normalize_rows(matrix)
+    transposed = normalized.T.tocsr()
+    n_items = normalized.shape[0]
+    width = min(k, n_items)
+    workers = workers or os.cpu_count() or 1
+    # Several blocks per worker keep every core busy until the end of the build.
+    block_rows = max(1, min(block_rows, -(-n_items // (4 * workers))))
+
+    segments = []
+    try:
+        specs = {
+            'normalized': _share_csr(normalized, segments),
+            'transposed': _share_csr(transposed, segments),
+            'items': share_array(np.full((n_items, width), -1, dtype=np.int32), segments),
+            'scores': share_array(np.zeros((n_items, width), dtype=np.float32), segments),
+        }
+        del normalized, transposed
+
+        blocks = [(start, min(start + block_rows, n_items)) for start in range(0, n_items, block_rows)]
+        # Spawned, not forked: the API builds on a background thread of the threaded
+        # server, and a fork of it could copy a held lock. Workers attach by segment name.
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs,),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(_neighbour_block, start, stop, k) for start, stop in blocks]
+            done = sum(future.result() for future in futures)
+        print(f"Computed neighbours for {done} items in {len(blocks)} blocks.")
+
+        segments_by_name = {segment.name: segment for segment in segments}
+        neighbour_items = copy_shared(specs['items'], segments_by_name)
+        neighbour_scores = copy_shared(specs['scores'], segments_by_name)
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    return neighbour_items, neighbour_scores
@@ -0,0 +1,247 @@
+# out_of_core.py
+
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from neighbours import merge_top_k, normalize_rows, top_k_from_block
+from sampling import count_interactions
+from sizing import BYTES_PER_BLOCK_CELL
+
+# Interactions are spilled to disk as fixed-size records, one file per shard.
+SPILL_DTYPE = np.dtype([('row', np.int32), ('col', np.int32), ('rating', np.float32)])
+
+
+# --- Progress file: lets an interrupted build pick up where it stopped ---
+
+def _load_progress(work_dir):
+    path = os.path.join(work_dir, 'progress.json')
+    if not os.path.exists(path):
+        return {'stage': 'start'}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_progress(work_dir, progress):
+    # Written to a temporary file and renamed, so a crash never leaves a half-written file.
+    path = os.path.join(work_dir, 'progress.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(progress, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+# --- Pass 1 and 2: id maps and spilling interactions into shard files ---
+
+def _append_by_shard(records, shard_of_record, prefix):
+    order = np.argsort(shard_of_record, kind='stable')
+    records, shard_of_record = records[order], shard_of_record[order]
+    shards, starts = np.unique(shard_of_record, return_index=True)
+    for shard, start, stop in zip(shards, starts, np.r_[starts[1:], len(records)]):
+        with open(f"{prefix}_{shard:05d}.bin", 'ab') as f:
+            f.write(records[start:stop].tobytes())
+
+
+def _spill_interactions(csv_path, spill_dir, item_index, user_index, shard_rows, chunksize):
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(spill_dir)
+    for chunk in pd.read_csv(csv_path, usecols=['user_id', 'product_id', 'rating'], chunksize=chunksize):
+        chunk = chunk.dropna()
+        items = item_index.get_indexer(chunk['product_id'].astype(str))
+        users = user_index.get_indexer(chunk['user_id'].astype(str))
+
+        records = np.empty(len(chunk), dtype=SPILL_DTYPE)
+        records['row'], records['col'], records['rating'] = items, users, chunk['rating'].to_numpy()
+        _append_by_shard(records, items // shard_rows, os.path.join(spill_dir, 'items'))
+
+        records['row'], records['col'] = users, items
+        _append_by_shard(records, users // shard_rows, os.path.join(spill_dir, 'users'))
+
+
+# --- Pass 3: one CSR shard per range of rows, saved as .npy files ---
+
+def _csr_from_spill(spill_path, first_row, n_rows, n_cols):
+    records = np.fromfile(spill_path, dtype=SPILL_DTYPE) if os.path.exists(spill_path) else \
+        np.empty(0, dtype=SPILL_DTYPE)
+    coords = (records['row'] - first_row, records['col'])
+    shape = (n_rows, n_cols)
+    # Repeated (user, product) ratings are averaged, like the in-memory build.
+    ratings = sparse.csr_matrix((records['rating'], coords), shape=shape)
+    counts = sparse.csr_matrix((np.ones(len(records), np.float32), coords), shape=shape)
+    ratings.data /= counts.data
+    return ratings
+
+
+def _save_csr(matrix, prefix):
+    for name in ('data', 'indices', 'indptr'):
+        np.save(f"{prefix}_{name}.npy", getattr(matrix, name))
+
+
+def _load_csr(prefix, shape):
+    arrays = [np.load(f"{prefix}_{name}.npy", mmap_mode='r') for name in ('data', 'indices', 'indptr')]
+    return sparse.csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+def _shard_bounds(n_rows, shard_rows):
+    return [(start, min(start + shard_rows, n_rows)) for start in range(0, n_rows, shard_rows)]
+
+
+def _write_shards(work_dir, n_items, n_users, shard_rows):
+    spill_dir = os.path.join(work_dir, 'spill')
+    shard_dir = os.path.join(work_dir, 'shards')
+    os.makedirs(shard_dir, exist_ok=True)
+
+    for shard, (start, stop) in enumerate(_shard_bounds(n_items, shard_rows)):
+        items = _csr_from_spill(os.path.join(spill_dir, f"items_{shard:05d}.bin"), start, stop - start, n_users)
+        _save_csr(normalize_rows(items), os.path.join(shard_dir, f"items_{shard:05d}"))
+
+    # The user x item matrix for serving is stitched from its row shards into
+    # single memory-mapped arrays, in the same layout save_model writes.
+    user_shards = []
+    for shard, (start, stop) in enumerate(_shard_bounds(n_users, shard_rows)):
+        users = _csr_from_spill(os.path.join(spill_dir, f"users_{shard:05d}.bin"), start, stop - start, n_items)
+        prefix = os.path.join(shard_dir, f"users_{shard:05d}")
+        _save_csr(users, prefix)
+        user_shards.append((prefix, (stop - start, n_items)))
+
+    nnz = sum(len(np.load(f"{prefix}_data.npy", mmap_mode='r')) for prefix, _ in user_shards)
+    open_memmap = np.lib.format.open_memmap
+    data = open_memmap(os.path.join(work_dir, 'user_items_data.npy'), 'w+', np.float32, (nnz,))
+    indices = open_memmap(os.path.join(work_dir, 'user_items_indices.npy'), 'w+', np.int32, (nnz,))
+    indptr = open_memmap(os.path.join(work_dir, 'user_items_indptr.npy'), 'w+', np.int64, (n_users + 1,))
+    offset, row = 0, 0
+    indptr[0] = 0
+    for prefix, shape in user_shards:
+        users = _load_csr(prefix, shape)
+        data[offset:offset + users.nnz] = users.data
+        indices[offset:offset + users.nnz] = users.indices
+        indptr[row + 1:row + shape[0] + 1] = offset + users.indptr[1:]
+        offset, row = offset + users.nnz, row + shape[0]
+    for array in (data, indices, indptr):
+        array.flush()
+
+
+# --- Pass 4: similarity block pairs merged into a disk-backed top-k array ---
+
+def _merge_into(neighbour_items, neighbour_scores, rows, block, first_col, n_cols, k, diagonal):
+    # Entries that came from this column shard are dropped before merging, so
+    # re-running a pair after a crash gives the same result as running it once.
+    items = np.array(neighbour_items[rows])
+    scores = np.array(neighbour_scores[rows])
+    stale = (items >= first_col) & (items < first_col + n_cols)
+    items[stale], scores[stale] = -1, 0
+
+    block_items, block_scores = top_k_from_block(block, k, 0 if diagonal else None)
+    block_items[block_items >= 0] += first_col
+    # With fewer items than k the stored lists are narrower than k, and the merge keeps to their width.
+    neighbour_items[rows], neighbour_scores[rows] = merge_top_k(items, scores, block_items, block_scores,
+                                                                neighbour_items.shape[1])
+
+
+def _shard_pairs(n_shards):
+    return [(a, b) for a in range(n_shards) for b in range(a, n_shards)]
+
+
+def shard_rows_for_budget(memory_budget_bytes):
+    """
+    Largest shard height whose pair of blocks fits in the memory budget.
+    """
+    return max(1, math.isqrt(int(memory_budget_bytes // (2 * BYTES_PER_BLOCK_CELL))))
+
+
+def build_out_of_core(csv_path, work_dir, k=50, memory_budget_bytes=512 * 2**20, shard_rows=None,
+                      chunksize=1_000_000):
+    """
+    Builds the model without ever holding the interaction matrix in memory.
+
+    The CSV is streamed into per-shard spill files, turned into memory-mapped
+    CSR shards, and every pair of item shards is multiplied block by block.
+    Each block updates a running top-k per item kept in .npy arrays on disk.
+    Progress is checkpointed after every step, so calling this again with the
+    same work_dir after a crash resumes the build. The finished work_dir can be
+    opened with recommender_model.load_model.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    progress = _load_progress(work_dir)
+    if shard_rows is None:
+        shard_rows = progress.get('shard_rows') or shard_rows_for_budget(memory_budget_bytes)
+
+    if progress['stage'] == 'start':
+        print("1. Counting interactions and building id maps...")
+        user_counts, product_counts = count_interactions(csv_path, chunksize)
+        np.save(os.path.join(work_dir, 'item_ids.npy'), np.sort(product_counts.index.to_numpy().astype(str)))
+        np.save(os.path.join(work_dir, 'user_ids.npy'), np.sort(user_counts.index.to_numpy().astype(str)))
+        progress = {'stage': 'ids', 'shard_rows': shard_rows, 'k': k}
+        _save_progress(work_dir, progress)
+
+    shard_rows, k = progress['shard_rows'], progress['k']
+    item_ids = np.load(os.path.join(work_dir, 'item_ids.npy'))
+    user_ids = np.load(os.path.join(work_dir, 'user_ids.npy'))
+    n_items, n_users = len(item_ids), len(user_ids)
+
+    if progress['stage'] == 'ids':
+        print(f"2. Spilling interactions into shards of {shard_rows} rows...")
+        _spill_interactions(csv_path, os.path.join(work_dir, 'spill'), pd.Index(item_ids), pd.Index(user_ids),
+                            shard_rows, chunksize)
+        progress['stage'] = 'spilled'
+        _save_progress(work_dir, progress)
+
+    if progress['stage'] == 'spilled':
+        print("3. Writing memory-mapped CSR shards...")
+        _write_shards(work_dir, n_items, n_users, shard_rows)
+        width = min(k, n_items)
+        open_memmap = np.lib.format.open_memmap
+        neighbour_items = open_memmap(os.path.join(work_dir, 'neighbour_items.npy'), 'w+', np.int32, (n_items, width))
+        neighbour_scores = open_memmap(os.path.join(work_dir, 'neighbour_scores.npy'), 'w+', np.float32, (n_items, width))
+        neighbour_items[:] = -1
+        neighbour_scores[:] = 0
+        neighbour_items.flush()
+        neighbour_scores.flush()
+        progress.update(stage='pairs', pairs_done=0)
+        _save_progress(work_dir, progress)
+        shutil.rmtree(os.path.join(work_dir, 'spill'))
+
+    if progress['stage'] == 'pairs':
+        neighbour_items = np.load(os.path.join(work_dir, 'neighbour_items.npy'), mmap_mode='r+')
+        neighbour_scores = np.load(os.path.join(work_dir, 'neighbour_scores.npy'), mmap_mode='r+')
+        bounds = _shard_bounds(n_items, shard_rows)
+        pairs = _shard_pairs(len(bounds))
+        shard_prefix = os.path.join(work_dir, 'shards', 'items_{:05d}')
+        print(f"4. Multiplying {len(pairs)} shard pairs ({progress['pairs_done']} already done)...")
+
+        for a, b in pairs[progress['pairs_done']:]:
+            (a_start, a_stop), (b_start, b_stop) = bounds[a], bounds[b]
+            left = _load_csr(shard_prefix.format(a), (a_stop - a_start, n_users))
+            right = _load_csr(shard_prefix.format(b), (b_stop - b_start, n_users))
+            block = (left @ right.T).toarray()
+
+            _merge_into(neighbour_items, neighbour_scores, slice(a_start, a_stop), block,
+                        b_start, b_stop - b_start, k, diagonal=(a == b))
+            if a != b:
+                _merge_into(neighbour_items, neighbour_scores, slice(b_start, b_stop), block.T,
+                            a_start, a_stop - a_start, k, diagonal=False)
+            neighbour_items.flush()
+            neighbour_scores.flush()
+            progress['pairs_done'] += 1
+            _save_progress(work_dir, progress)
+
+        progress['stage'] = 'done'
+        _save_progress(work_dir, progress)
+        shutil.rmtree(os.path.join(work_dir, 'shards'))
+
+    print(f"--- Out-of-core build complete: {n_items} items, {n_users} users in {work_dir} ---")
+    return work_dir
+
+
+# --- Main entry point ---
+if __name__ == "__main__":
+    processed_data_file = r'D:\Datasets\processed_ecommerce_data.csv'
+    model_dir = r'D:\Datasets\recommender_model'
+
+    build_out_of_core(processed_data_file, model_dir)
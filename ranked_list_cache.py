@@ -0,0 +1,65 @@
+# ranked_list_cache.py
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class RankedListCache:
+    """
+    Deep ranked lists kept for paging, each under a random token. The first
+    page of a listing stores the whole list; later pages are slices of it, so
+    they cost no scoring and stay consistent even if the model is swapped in
+    between. Holds at most max_lists lists (least recently used are dropped
+    first), each for at most ttl_seconds.
+    """
+
+    def __init__(self, max_lists=10000, ttl_seconds=600):
+        self.max_lists = max_lists
+        self.ttl_seconds = ttl_seconds
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, ranked, **info):
+        """
+        Stores a ranked list with any extra fields (e.g. user_id) and returns its token.
+        """
+        token = secrets.token_urlsafe(12)
+        entry = dict(info, ranked=ranked, stored=time.time())
+        with self._lock:
+            self._lists[token] = entry
+            while len(self._lists) > self.max_lists:
+                self._lists.popitem(last=False)
+        return token
+
+    def get(self, token):
+        """
+        The stored entry (with 'ranked' and the extra fields), or None when it is unknown or expired.
+        """
+        with self._lock:
+            entry = self._lists.get(token)
+            if entry is None:
+                return None
+            if time.time() - entry['stored'] > self.ttl_seconds:
+                del self._lists[token]
+                return None
+            self._lists.move_to_end(token)
+            return entry
+
+    def __len__(self):
+        return len(self._lists)
+
+
+def make_cursor(token, offset):
+    return f"{token}.{offset}"
+
+
+def parse_cursor(cursor):
+    """
+    Splits a cursor into (token, offset); returns (None, 0) for a malformed one.
+    """
+    token, _, offset = cursor.rpartition('.')
+    if not token or not offset.isdigit():
+        return None, 0
+    return token, int(offset)
@@ -0,0 +1,118 @@
+# rec_store.py
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+class RecommendationStore:
+    """
+    Local SQLite file with the precomputed top-N recommendations of the most
+    active users, who are the most expensive to score and the most frequent
+    visitors. Reading is a single primary-key lookup.
+
+    The file is rebuilt as a whole by refresh() and swapped in with a rename,
+    so readers never see a half-written store. Every entry belongs to one
+    model version; lookups for any other version miss.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._generation = 0
+        self._local = threading.local()
+        # Refreshes run one at a time; one for a model that is no longer the
+        # latest requested (e.g. a reload followed by a rollback) is dropped.
+        self._refresh_lock = threading.Lock()
+        self._latest_version = None
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads, and after a
+        # refresh every thread has to reopen the file to see the new one.
+        local = self._local
+        if getattr(local, 'generation', None) != self._generation:
+            if getattr(local, 'connection', None) is not None:
+                local.connection.close()
+            local.connection, local.meta = None, {}
+            local.generation = self._generation
+            if os.path.exists(self.path):
+                local.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+                local.meta = dict(local.connection.execute("SELECT key, value FROM meta"))
+        return local.connection, local.meta
+
+    def get(self, user_id, model_version, num_recommendations=5):
+        """
+        Returns the stored (product_id, score) pairs for a user, or None when the
+        user is not stored, the store was built from another model version, or
+        fewer than num_recommendations were stored per user.
+        """
+        connection, meta = self._connection()
+        if connection is None or meta.get('model_version') != model_version:
+            return None
+        if num_recommendations > int(meta['num_recommendations']):
+            return None
+        row = connection.execute("SELECT recommendations FROM recommendations WHERE user_id = ?",
+                                 (user_id,)).fetchone()
+        if row is None:
+            return None
+        return [tuple(pair) for pair in json.loads(row[0])[:num_recommendations]]
+
+    def refresh(self, model, num_users=10000, num_recommendations=20):
+        """
+        Scores the num_users heaviest users of the model and replaces the store file.
+        """
+        with self._refresh_lock:
+            if self._superseded(model):
+                return
+            directory, name = os.path.split(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+            os.close(fd)
+            try:
+                self._write(tmp_path, model, num_users, num_recommendations)
+                if self._superseded(model):
+                    return
+                os.replace(tmp_path, self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self._generation += 1
+
+    def _superseded(self, model):
+        if self._latest_version not in (None, model.version):
+            print(f"Recommendation store refresh for model {model.version} dropped: "
+                  f"model {self._latest_version} came after it.")
+            return True
+        return False
+
+    def _write(self, tmp_path, model, num_users, num_recommendations):
+        started = time.time()
+        user_ids = model.heaviest_users(num_users)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE recommendations (user_id TEXT PRIMARY KEY, recommendations TEXT)")
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ('model_version', model.version),
+                ('num_recommendations', str(num_recommendations)),
+            ])
+            connection.executemany("INSERT INTO recommendations VALUES (?, ?)", (
+                (user_id, json.dumps(model.recommend(user_id, num_recommendations)))
+                for user_id in user_ids))
+            connection.commit()
+        finally:
+            connection.close()
+        print(f"Recommendation store refreshed: {len(user_ids)} users for model {model.version} "
+              f"in {time.time() - started:.1f}s.")
+
+    def refresh_in_background(self, model, num_users=10000, num_recommendations=20):
+        """
+        Runs refresh() on a daemon thread, so serving can start right away.
+        """
+        self._latest_version = model.version
+        thread = threading.Thread(target=self.refresh, args=(model, num_users, num_recommendations),
+                                  name='recommendation-store-refresh', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,429 @@
+# recommender_model.py
+
+import copy
+import os
+import time
+import uuid
+from functools import cached_property
+
+import numpy as np
+
+# This module is on the serving import path and only needs NumPy there. The
+# build-time modules (pandas, SciPy) are imported inside build_model.
+
+
+# Length of the most-popular list kept per model for fallback answers.
+POPULAR_ITEMS_KEPT = 1000
+
+# Source items merged between two deadline checks in score_items_until.
+DEADLINE_CHUNK_ITEMS = 256
+
+# Source products listed per recommendation when scoring is explained.
+EXPLAIN_SOURCES = 3
+
+# One .npy file per array; see save_model and load_model.
+MODEL_ARRAYS = ('item_ids', 'user_ids', 'user_items_data', 'user_items_indices', 'user_items_indptr',
+                'neighbour_items', 'neighbour_scores')
+
+
+class CsrArrays:
+    """
+    The parts of a CSR matrix the serving path reads, without importing SciPy.
+    A scipy.sparse.csr_matrix can be used in its place.
+    """
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = shape
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+
+class RecommenderModel:
+    """
+    Item-based collaborative filtering model served from a top-k neighbour index.
+
+    user_items is the user x item CSR rating matrix; neighbour_items and
+    neighbour_scores hold the k most similar items of every item (-1 = empty slot).
+    version identifies the build, so derived data (e.g. precomputed
+    recommendations) can tell which model it came from.
+    """
+
+    def __init__(self, item_ids, user_ids, user_items, neighbour_items, neighbour_scores, version=None):
+        self.version = version or uuid.uuid4().hex[:12]
+        self.item_ids = item_ids
+        self.user_ids = user_ids
+        self.user_items = user_items
+        self.neighbour_items = neighbour_items
+        self.neighbour_scores = neighbour_scores
+        self.user_index = {user_id: code for code, user_id in enumerate(user_ids.tolist())}
+        self.item_index = {item_id: code for code, item_id in enumerate(item_ids.tolist())}
+        # Business rules over this model's item codes (item_filters.ItemFilters), attached after loading.
+        self.item_filters = None
+
+    @property
+    def k(self):
+        return self.neighbour_items.shape[1]
+
+    def with_neighbours(self, neighbour_items, neighbour_scores, version):
+        """
+        A model over the same users, items and ratings with another neighbour
+        index. The id arrays, the id lookup dicts, the rating matrix and the
+        item filters are shared with this model, not copied.
+        """
+        variant = copy.copy(self)
+        variant.version = version
+        variant.neighbour_items = neighbour_items
+        variant.neighbour_scores = neighbour_scores
+        return variant
+
+    def heaviest_users(self, num_users):
+        """
+        The num_users users with the most rated products, heaviest first.
+        """
+        ratings_per_user = np.diff(self.user_items.indptr)
+        num_users = min(num_users, len(ratings_per_user))
+        if num_users == 0:
+            return []
+        heaviest = np.argpartition(-ratings_per_user, num_users - 1)[:num_users]
+        heaviest = heaviest[np.argsort(-ratings_per_user[heaviest], kind='stable')]
+        return [str(user_id) for user_id in self.user_ids[heaviest]]
+
+    @cached_property
+    def _popular(self):
+        ratings_per_item = np.bincount(np.asarray(self.user_items.indices), minlength=len(self.item_ids))
+        num_items = min(POPULAR_ITEMS_KEPT, len(ratings_per_item))
+        if num_items == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        popular = np.argpartition(-ratings_per_item, num_items - 1)[:num_items]
+        popular = popular[np.argsort(-ratings_per_item[popular], kind='stable')]
+        return popular, ratings_per_item[popular].astype(np.float64)
+
+    def popular_items(self, num_recommendations=5, allowed=None):
+        """
+        The most rated products as (product_id, number of ratings) pairs. This is
+        the fallback answer when a request cannot be personalised or scored.
+        allowed is an optional boolean mask over item codes (see item_filters).
+        """
+        popular, counts = self._popular
+        if allowed is not None:
+            keep = allowed[popular]
+            popular, counts = popular[keep], counts[keep]
+        return [(str(self.item_ids[item]), float(count))
+                for item, count in zip(popular[:num_recommendations], counts[:num_recommendations])]
+
+    def has_user(self, user_id):
+        return user_id in self.user_index
+
+    def user_ratings(self, user_id):
+        """
+        Returns the item codes a user rated and the ratings they gave.
+        """
+        code = self.user_index[user_id]
+        start, stop = self.user_items.indptr[code], self.user_items.indptr[code + 1]
+        return self.user_items.indices[start:stop], self.user_items.data[start:stop]
+
+    def similar_items(self, product_id, num_similar=10):
+        """
+        Returns the precomputed most similar (product_id, score) pairs of a
+        product, or None when the product is not in the model. No scoring
+        happens here: it is a slice of the neighbour index, so nothing is cached.
+        """
+        code = self.item_index.get(product_id)
+        if code is None:
+            return None
+        items = self.neighbour_items[code, :num_similar].tolist()
+        scores = self.neighbour_scores[code, :num_similar].tolist()
+        return [(str(self.item_ids[item]), score) for item, score in zip(items, scores) if item >= 0]
+
+    def similar_items_many(self, product_ids, num_similar=10):
+        """
+        Multi-get of similar_items; unknown products map to None.
+        """
+        return {product_id: self.similar_items(product_id, num_similar) for product_id in product_ids}
+
+    @staticmethod
+    def _sum_by_item(candidates, contributions):
+        # Sums the contributions per candidate item; -1 marks an empty neighbour slot.
+        valid = candidates >= 0
+        items, inverse = np.unique(candidates[valid], return_inverse=True)
+        return items, np.bincount(inverse, weights=contributions[valid], minlength=len(items))
+
+    def _explain(self, items, scores, explain):
+        # explain holds the flat (candidate, contribution, source item) arrays the
+        # scores were summed from. Returns, per item, its EXPLAIN_SOURCES largest
+        # contributions as (source product_id, share of the item's score).
+        if len(items) == 0:
+            return []
+        candidates, contributions, sources = explain
+        order = np.argsort(items, kind='stable')
+        positions = np.minimum(np.searchsorted(items[order], candidates), len(items) - 1)
+        hit = (items[order][positions] == candidates) & (candidates >= 0)
+        targets, sources, contributions = order[positions[hit]], sources[hit], contributions[hit]
+
+        ranked = np.lexsort((-contributions, targets))
+        targets, sources, contributions = targets[ranked], sources[ranked], contributions[ranked]
+        rank_in_item = np.arange(len(targets)) - np.searchsorted(targets, targets)
+        keep = rank_in_item < EXPLAIN_SOURCES
+        explanations = [[] for _ in items]
+        for target, source, contribution in zip(targets[keep].tolist(), sources[keep].tolist(),
+                                                contributions[keep].tolist()):
+            explanations[target].append((str(self.item_ids[source]), float(contribution / scores[target])))
+        return explanations
+
+    def _best(self, items, scores, source_items, num_recommendations, allowed=None, explain=None):
+        # Drops the source items (and items outside the allowed mask) and returns
+        # the best num_recommendations as (product_id, score) pairs, or as
+        # (product_id, score, explanation) triples when explain is given.
+        keep = ~np.isin(items, source_items)
+        if allowed is not None:
+            keep &= allowed[items]
+        items, scores = items[keep], scores[keep]
+        if allowed is not None and len(items) < num_recommendations:
+            # A narrow filter can leave too few scored items; the rest of the list
+            # is filled with allowed popular products, scored 0.
+            popular, _ = self._popular
+            extra = popular[allowed[popular] & ~np.isin(popular, source_items) & ~np.isin(popular, items)]
+            extra = extra[:num_recommendations - len(items)]
+            items = np.concatenate([items, extra])
+            scores = np.concatenate([scores, np.zeros(len(extra))])
+
+        if len(items) > num_recommendations:
+            best = np.argpartition(-scores, num_recommendations - 1)[:num_recommendations]
+            items, scores = items[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        items, scores = items[order], scores[order]
+        if explain is not None:
+            explanations = self._explain(items, scores, explain)
+            return [(str(self.item_ids[item]), float(score), explanation)
+                    for item, score, explanation in zip(items, scores, explanations)]
+        return [(str(self.item_ids[item]), float(score)) for item, score in zip(items, scores)]
+
+    def score_items(self, source_items, weights, num_recommendations=5, allowed=None, explain=False):
+        """
+        Sparse merge of the neighbour lists of source_items: every neighbour
+        scores similarity * weight of its source item, summed over sources.
+        Source items are never recommended. With an allowed mask, only allowed
+        items are ranked and the list is padded with allowed popular products
+        when fewer are scored. Returns the best (product_id, score) pairs.
+
+        With explain, each pair gets a third element: the source products that
+        contributed most to its score, as (product_id, share) pairs. They are
+        read from the contributions this merge already computed.
+        """
+        candidates = self.neighbour_items[source_items]
+        contributions = self.neighbour_scores[source_items] * weights[:, None]
+        items, scores = self._sum_by_item(candidates, contributions)
+        if explain:
+            explain = (candidates.ravel(), contributions.ravel(), np.repeat(source_items, candidates.shape[1]))
+        return self._best(items, scores, source_items, num_recommendations, allowed, explain or None)
+
+    def score_items_until(self, source_items, weights, deadline, num_recommendations=5, allowed=None,
+                          explain=False):
+        """
+        score_items that stops at a deadline (a time.perf_counter() value).
+
+        Source items are merged into running per-item sums in chunks, highest
+        weight first. When the next chunk would not finish before the deadline,
+        the best top-N of the sums so far is returned. Returns (recommendations, complete).
+        """
+        order = np.argsort(-weights, kind='stable')
+        items = np.empty(0, dtype=self.neighbour_items.dtype)
+        scores = np.empty(0, dtype=np.float64)
+        # Raw contributions of the merged chunks, kept only to explain the result.
+        explained = []
+        merged, chunk_seconds = 0, 0.0
+        while merged < len(order):
+            if merged and time.perf_counter() + chunk_seconds > deadline:
+                break
+            chunk_started = time.perf_counter()
+            chunk = order[merged:merged + DEADLINE_CHUNK_ITEMS]
+            candidates = self.neighbour_items[source_items[chunk]]
+            contributions = self.neighbour_scores[source_items[chunk]] * weights[chunk, None]
+            items, scores = self._sum_by_item(np.concatenate([items, candidates.ravel()]),
+                                              np.concatenate([scores, contributions.ravel()]))
+            if explain:
+                explained.append((candidates.ravel(), contributions.ravel(),
+                                  np.repeat(source_items[chunk], candidates.shape[1])))
+            merged += len(chunk)
+            chunk_seconds = time.perf_counter() - chunk_started
+        explain = tuple(np.concatenate(parts) for parts in zip(*explained)) if explain else None
+        return self._best(items, scores, source_items, num_recommendations, allowed, explain), merged == len(order)
+
+    def candidate_similarities(self, codes):
+        """
+        M x M similarities between items, read from the neighbour index: the
+        stored score when one item is in the other's top-k (the larger of the
+        two directions), 0 otherwise.
+        """
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        neighbours = self.neighbour_items[codes]
+        positions = np.minimum(np.searchsorted(sorted_codes, neighbours), len(codes) - 1)
+        match = sorted_codes[positions] == neighbours
+        rows, slots = np.nonzero(match)
+        similarities = np.zeros((len(codes), len(codes)))
+        similarities[rows, order[positions[rows, slots]]] = self.neighbour_scores[codes][rows, slots]
+        return np.maximum(similarities, similarities.T)
+
+    def diversify(self, recommendations, num_recommendations=5, diversity=0.3):
+        """
+        Maximal marginal relevance re-ranking of scored (product_id, score) pairs.
+        Picks num_recommendations of them one at a time, each maximising
+        (1 - diversity) * relevance - diversity * (similarity to the closest one
+        already picked); relevance is the score scaled to [0, 1]. diversity 0
+        keeps the order of the scores. Scores are returned unchanged.
+        """
+        if diversity <= 0 or len(recommendations) <= 1:
+            return recommendations[:num_recommendations]
+        codes = np.array([self.item_index[recommendation[0]] for recommendation in recommendations], dtype=np.int64)
+        relevance = np.array([recommendation[1] for recommendation in recommendations], dtype=np.float64)
+        relevance /= max(relevance.max(), 1e-12)
+        similarities = self.candidate_similarities(codes)
+
+        closest = np.zeros(len(codes))
+        available = np.ones(len(codes), dtype=bool)
+        picked = []
+        for _ in range(min(num_recommendations, len(codes))):
+            marginal = np.where(available, (1 - diversity) * relevance - diversity * closest, -np.inf)
+            best = int(np.argmax(marginal))
+            picked.append(best)
+            available[best] = False
+            np.maximum(closest, similarities[best], out=closest)
+        return [recommendations[i] for i in picked]
+
+    def recommend(self, user_id, num_recommendations=5, allowed=None, explain=False):
+        """
+        Scores items by summing similarity * rating over the neighbours of every
+        item the user rated, and returns the best (product_id, score) pairs.
+        """
+        if not self.has_user(user_id):
+            return []
+
+        rated_items, ratings = self.user_ratings(user_id)
+        return self.score_items(rated_items, ratings, num_recommendations, allowed, explain)
+
+    def recommend_until(self, user_id, deadline, num_recommendations=5, allowed=None, explain=False):
+        """
+        recommend() within a deadline (a time.perf_counter() value). Users with
+        long histories are scored from their highest-rated products first, and
+        whatever is merged by the deadline is returned.
+        Returns (recommendations, complete).
+        """
+        if not self.has_user(user_id):
+            return [], True
+
+        rated_items, ratings = self.user_ratings(user_id)
+        if len(rated_items) <= DEADLINE_CHUNK_ITEMS:
+            return self.score_items(rated_items, ratings, num_recommendations, allowed, explain), True
+        return self.score_items_until(rated_items, ratings, deadline, num_recommendations, allowed, explain)
+
+    def recommend_for_items(self, product_ids, weights=None, ages=None, half_life=None, num_recommendations=5,
+                            allowed=None, explain=False):
+        """
+        Recommendations for an anonymous session or cart, from its products alone.
+
+        weights scales each product (default 1). With half_life set, a product
+        that is `age` steps old counts 0.5 ** (age / half_life) as much; without
+        ages, the last product is age 0, the one before it age 1, and so on.
+        Products not in the model are ignored.
+        """
+        weights = np.ones(len(product_ids)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if half_life:
+            ages = np.arange(len(product_ids))[::-1] if ages is None else np.asarray(ages, dtype=np.float64)
+            weights = weights * 0.5 ** (ages / half_life)
+
+        codes = np.array([self.item_index.get(product_id, -1) for product_id in product_ids], dtype=np.int64)
+        known = codes >= 0
+        if not known.any():
+            return []
+        # The same product twice in a basket adds up its weights.
+        items, inverse = np.unique(codes[known], return_inverse=True)
+        return self.score_items(items, np.bincount(inverse, weights=weights[known]), num_recommendations, allowed,
+                                explain)
+
+
+def build_model(df, k=50, block_rows=None, workers=1):
+    """
+    Builds a RecommenderModel from interaction records with user_id, product_id and rating.
+    With workers > 1 the neighbour index is computed by a process pool.
+    """
+    from neighbours import build_interaction_matrix, build_neighbour_index, build_neighbour_index_parallel
+    from sizing import SIMILARITY_BLOCK_ROWS
+
+    block_rows = block_rows or SIMILARITY_BLOCK_ROWS
+    matrix, item_ids, user_ids = build_interaction_matrix(df)
+    print("User-Item matrix created. Shape (products, users):", matrix.shape)
+
+    print(f"\nCalculating the top-{k} most similar items using Cosine Similarity...")
+    if workers > 1:
+        neighbour_items, neighbour_scores = build_neighbour_index_parallel(matrix, k, block_rows, workers)
+    else:
+        neighbour_items, neighbour_scores = build_neighbour_index(matrix, k, block_rows)
+
+    return RecommenderModel(item_ids, user_ids, matrix.T.tocsr(), neighbour_items, neighbour_scores)
+
+
+def warm_up_model(model, num_queries=200, page_bytes=4096):
+    """
+    Gets a freshly loaded model ready for traffic: reads every memory-mapped
+    array once so its pages are resident, then scores the heaviest users so
+    the first real requests do not pay for any one-off setup. The fallback
+    list of popular products is computed here too.
+    """
+    started = time.time()
+    arrays = (model.item_ids, model.user_ids, model.user_items.data, model.user_items.indices,
+              model.user_items.indptr, model.neighbour_items, model.neighbour_scores)
+    for array in arrays:
+        if isinstance(array, np.memmap):
+            flat = array.reshape(-1).view(np.uint8)
+            int(flat[::page_bytes].sum())
+
+    model.popular_items()
+    for user_id in model.heaviest_users(num_queries):
+        model.recommend(user_id)
+    print(f"Warmed up model {model.version} in {time.time() - started:.1f}s.")
+    return model
+
+
+def save_model(model, directory):
+    """
+    Writes the model as one .npy file per array, so it can be memory-mapped back.
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {
+        'item_ids': model.item_ids.astype(str),
+        'user_ids': model.user_ids.astype(str),
+        'user_items_data': model.user_items.data,
+        'user_items_indices': model.user_items.indices,
+        'user_items_indptr': model.user_items.indptr,
+        'neighbour_items': model.neighbour_items,
+        'neighbour_scores': model.neighbour_scores,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    with open(os.path.join(directory, 'version.txt'), 'w') as f:
+        f.write(model.version)
+
+
+def load_model(directory, mmap_mode='r'):
+    """
+    Loads a model written by save_model or by the out-of-core build. With
+    mmap_mode='r' the arrays are memory-mapped instead of read into memory.
+    """
+    arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+              for name in MODEL_ARRAYS}
+    shape = (len(arrays['user_ids']), len(arrays['item_ids']))
+    user_items = CsrArrays(arrays['user_items_data'], arrays['user_items_indices'],
+                           arrays['user_items_indptr'], shape)
+    version_path = os.path.join(directory, 'version.txt')
+    version = None
+    if os.path.exists(version_path):
+        with open(version_path) as f:
+            version = f.read().strip()
+    return RecommenderModel(arrays['item_ids'], arrays['user_ids'], user_items,
+                            arrays['neighbour_items'], arrays['neighbour_scores'], version)
@@ -0,0 +1,221 @@
+# sampling.py
+
+import numpy as np
+import pandas as pd
+
+from sizing import estimate_model_bytes, expected_items, mib, print_sizing_report
+
+
+def describe_matrix_size(df, k=None):
+    """
+    Reports the size of the model that would be built from df, before building it.
+    """
+    n_users = df['user_id'].nunique()
+    n_items = df['product_id'].nunique()
+    report = {
+        'rows': len(df),
+        'users': n_users,
+        'items': n_items,
+        'estimated_bytes': int(estimate_model_bytes(n_users, n_items, len(df), k)['total']),
+    }
+    print(f"Sample will build a {n_items} x {n_users} user-item matrix from {len(df)} ratings "
+          f"(~{mib(report['estimated_bytes'])} at peak).")
+    return report
+
+
+def count_interactions(file_path, chunksize=1_000_000):
+    """
+    Counts ratings per user and per product in one streaming pass over the CSV.
+    """
+    user_counts, product_counts = None, None
+    for chunk in pd.read_csv(file_path, usecols=['user_id', 'product_id'], chunksize=chunksize):
+        users = chunk['user_id'].value_counts()
+        products = chunk['product_id'].value_counts()
+        user_counts = users if user_counts is None else user_counts.add(users, fill_value=0)
+        product_counts = products if product_counts is None else product_counts.add(products, fill_value=0)
+    if user_counts is None:
+        empty = pd.Series(dtype=np.int64)
+        return empty, empty
+    return user_counts.astype(np.int64), product_counts.astype(np.int64)
+
+
+def _user_keys(user_ids, random_state):
+    # Hashing the id (instead of drawing from an RNG) gives every user the same
+    # priority no matter which chunk it shows up in, which keeps the selection
+    # identical between the in-memory and the streaming pass.
+    hash_key = f"{random_state:016d}"[-16:]
+    return pd.util.hash_pandas_object(pd.Series(user_ids), index=False, hash_key=hash_key).to_numpy()
+
+
+def _activity_strata(counts):
+    # Users are bucketed by powers of two of their interaction count: 5-7, 8-15, 16-31, ...
+    return np.floor(np.log2(np.maximum(counts, 1))).astype(np.int64)
+
+
+def select_users(user_counts, row_budget=None, min_interactions=5, stratify=False, random_state=42):
+    """
+    Chooses whole users so that their combined interactions fit in row_budget.
+
+    This is a bottom-k priority reservoir: every user gets a fixed pseudo-random
+    key and users are taken in key order until the budget is spent. With
+    stratify=True the budget is split between activity strata in proportion to
+    the interactions each stratum holds, so heavy and light users keep their share.
+    Returns the selected user ids in priority order.
+    """
+    user_counts = user_counts[user_counts >= min_interactions]
+    if len(user_counts) == 0:
+        return user_counts.index[:0]
+
+    users = user_counts.index.to_numpy()
+    counts = user_counts.to_numpy()
+    order = np.argsort(_user_keys(users, random_state), kind='stable')
+    users, counts = users[order], counts[order]
+
+    if row_budget is None or counts.sum() <= row_budget:
+        return pd.Index(users)
+
+    if not stratify:
+        keep = np.cumsum(counts) <= row_budget
+        return pd.Index(users[keep])
+
+    strata = _activity_strata(counts)
+    keep = np.zeros(len(users), dtype=bool)
+    total = counts.sum()
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        stratum_budget = row_budget * counts[members].sum() / total
+        keep[members] = np.cumsum(counts[members]) <= stratum_budget
+
+    # Budget a stratum could not use (e.g. one huge user) goes to the next users in key order.
+    spare = row_budget - counts[keep].sum()
+    rest = np.flatnonzero(~keep)
+    keep[rest] = np.cumsum(counts[rest]) <= spare
+    return pd.Index(users[keep])
+
+
+def user_budget_curve(user_counts, min_interactions=5, random_state=42):
+    """
+    Cumulative number of records taken as users are added in priority order.
+    Entry i is the record count of a sample holding the first i + 1 users.
+    """
+    user_counts = user_counts[user_counts >= min_interactions]
+    order = np.argsort(_user_keys(user_counts.index.to_numpy(), random_state), kind='stable')
+    return np.cumsum(user_counts.to_numpy()[order])
+
+
+def _trim_to_memory_budget(df, selected_users, memory_budget_bytes, k=None):
+    # Walk the users in priority order and find the longest prefix whose matrix
+    # fits. Item counts grow with the prefix, so they are tracked with a
+    # first-occurrence cumulative sum over the sampled rows.
+    rank = pd.Series(np.arange(len(selected_users)), index=selected_users)
+    user_rank = rank.reindex(df['user_id']).to_numpy()
+    order = np.argsort(user_rank, kind='stable')
+    ranks = user_rank[order]
+    new_item = ~df['product_id'].iloc[order].duplicated().to_numpy()
+    items_seen = np.cumsum(new_item)
+
+    last_row_per_user = np.flatnonzero(np.r_[ranks[1:] != ranks[:-1], True])
+    n_users = np.arange(1, len(last_row_per_user) + 1)
+    n_items = items_seen[last_row_per_user]
+    n_rows = last_row_per_user + 1
+    fits = estimate_model_bytes(n_users, n_items, n_rows, k)['total'] <= memory_budget_bytes
+    n_keep = int(np.argmin(fits)) if not fits.all() else len(fits)
+    return selected_users[:n_keep]
+
+
+def sample_users(df, row_budget=None, memory_budget_bytes=None, min_interactions=5,
+                 stratify=False, random_state=42, k=None):
+    """
+    Samples whole user histories instead of random rows, so sampled users keep
+    enough ratings to survive the min_interactions filter.
+    """
+    selected = select_users(df['user_id'].value_counts(), row_budget, min_interactions,
+                            stratify, random_state)
+    sample = df[df['user_id'].isin(selected)]
+    if memory_budget_bytes is not None and len(sample) > 0:
+        selected = _trim_to_memory_budget(sample, selected, memory_budget_bytes, k)
+        sample = sample[sample['user_id'].isin(selected)]
+    print(f"Selected {len(selected)} whole users ({len(sample)} of {len(df)} records).")
+    describe_matrix_size(sample, k)
+    return sample.reset_index(drop=True)
+
+
+def stream_sample_users(file_path, row_budget=None, memory_budget_bytes=None, min_interactions=5,
+                        stratify=False, random_state=42, k=None, user_counts=None, chunksize=1_000_000):
+    """
+    Same selection as sample_users, but reads the CSV in chunks so the full
+    dataset never has to fit in memory. The first pass only counts interactions
+    per user (skipped when user_counts is given); the second keeps the rows of
+    the selected users.
+    """
+    if user_counts is None:
+        user_counts, _ = count_interactions(file_path, chunksize)
+    if len(user_counts) == 0:
+        return pd.read_csv(file_path, nrows=0)
+
+    selected = select_users(user_counts, row_budget, min_interactions,
+                            stratify, random_state)
+    kept = [chunk[chunk['user_id'].isin(selected)]
+            for chunk in pd.read_csv(file_path, chunksize=chunksize)]
+    sample = pd.concat(kept, ignore_index=True)
+    if memory_budget_bytes is not None and len(sample) > 0:
+        selected = _trim_to_memory_budget(sample, selected, memory_budget_bytes, k)
+        sample = sample[sample['user_id'].isin(selected)]
+    print(f"Selected {len(selected)} whole users ({len(sample)} of {int(user_counts.sum())} records).")
+    describe_matrix_size(sample, k)
+    return sample.reset_index(drop=True)
+
+
+def plan_sample(user_counts, product_counts, memory_budget_bytes, k_options=(50, 20, 10),
+                min_interactions_options=(5, 10, 20), max_rows=None, min_rows=1000,
+                max_k_row_loss=0.1, random_state=42, grid_points=256, workers=1):
+    """
+    Chooses the sample size, min_interactions and neighbour count k so that the
+    build fits in memory_budget_bytes. Only per-user and per-product interaction
+    counts are used, so the plan is made before anything large is allocated.
+
+    The plan keeping the most records wins, except that a larger k is preferred
+    as long as it costs less than max_k_row_loss of those records. Returns None
+    after printing the sizing report when no configuration keeps min_rows records.
+    """
+    total_rows = int(user_counts.sum())
+    plans = []
+    for min_interactions in min_interactions_options:
+        rows = user_budget_curve(user_counts, min_interactions, random_state)
+        if max_rows is not None:
+            rows = rows[rows <= max_rows]
+        if len(rows) == 0:
+            continue
+
+        # Size a geometric grid of sample sizes rather than every user prefix.
+        grid = np.unique(np.geomspace(1, len(rows), num=min(grid_points, len(rows))).astype(np.int64)) - 1
+        rows_at, users_at = rows[grid], grid + 1
+        items_at = expected_items(product_counts, rows_at / total_rows, min_interactions)
+
+        for k in k_options:
+            estimate = estimate_model_bytes(users_at, items_at, rows_at, k, workers=workers)['total']
+            fitting = np.flatnonzero(estimate <= memory_budget_bytes)
+            best = fitting[-1] if len(fitting) else 0
+            plans.append({
+                'k': k,
+                'min_interactions': min_interactions,
+                'row_budget': int(rows_at[best]),
+                'users': int(users_at[best]),
+                'items': int(round(items_at[best])),
+                'estimated_bytes': int(estimate[best]),
+                'fits': bool(len(fitting) and rows_at[best] >= min_rows),
+            })
+
+    print_sizing_report(plans, memory_budget_bytes)
+    feasible = [plan for plan in plans if plan['fits']]
+    if not feasible:
+        print(f"Error: no configuration keeps {min_rows} records within {mib(memory_budget_bytes)}. "
+              f"Raise the memory budget or lower min_rows.")
+        return None
+
+    most_rows = max(plan['row_budget'] for plan in feasible)
+    good_enough = [plan for plan in feasible if plan['row_budget'] >= (1 - max_k_row_loss) * most_rows]
+    plan = max(good_enough, key=lambda p: (p['k'] if p['k'] is not None else np.inf, p['row_budget']))
+    print(f"Chosen plan: k={plan['k']}, min_interactions={plan['min_interactions']}, "
+          f"up to {plan['row_budget']} records (~{mib(plan['estimated_bytes'])}).")
+    return plan
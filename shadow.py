@@ -0,0 +1,193 @@
+# shadow.py
+
+import json
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from latency_histogram import LatencyHistogram
+from recommender_model import load_model
+
+# Requests handed to the pool but not finished yet, per worker. Past this the
+# pool is behind and further samples are dropped instead of queued.
+PENDING_PER_WORKER = 4
+
+# Set in each worker process by _load_candidate.
+_candidate = None
+
+
+def _load_candidate(directory):
+    global _candidate
+    _candidate = load_model(directory)
+
+
+def _candidate_version():
+    return _candidate.version
+
+
+def _score_candidate(user_id, num_recommendations):
+    # Runs in a worker process: the candidate's list for the user and how long it took.
+    started = time.perf_counter()
+    recommendations = _candidate.recommend(user_id, num_recommendations) if _candidate.has_user(user_id) else None
+    seconds = time.perf_counter() - started
+    return _candidate.version, None if recommendations is None else [pid for pid, *_ in recommendations], seconds
+
+
+def overlap_at(production, candidate, n):
+    """
+    Share of the first n production products that are also in the candidate's first n.
+    """
+    if n == 0:
+        return 1.0
+    return len(set(production[:n]) & set(candidate[:n])) / n
+
+
+def rank_correlation(production, candidate):
+    """
+    Spearman correlation of two ranked lists over the products in either of
+    them; a product missing from one list ranks just past its end. None when
+    it is undefined (fewer than two products, or one list ranks them all alike).
+    """
+    products = list(dict.fromkeys(production + candidate))
+    if len(products) < 2:
+        return None
+    production_rank = {product: rank for rank, product in enumerate(production)}
+    candidate_rank = {product: rank for rank, product in enumerate(candidate)}
+    x = np.array([production_rank.get(product, len(production)) for product in products], dtype=np.float64)
+    y = np.array([candidate_rank.get(product, len(candidate)) for product in products], dtype=np.float64)
+    if x.std() == 0 or y.std() == 0:
+        return None
+    return float(np.corrcoef(x, y)[0, 1])
+
+
+class ShadowScorer:
+    """
+    Scores a sampled share of live requests with a candidate model and compares
+    the result with what production served.
+
+    The candidate is loaded (memory-mapped) in each process of a small worker
+    pool, so its scoring does not compete with request threads for the GIL.
+    offer() only hands the request to the pool and never waits: when the
+    sample misses, or the pool already has enough work, the request is not
+    shadowed. Comparisons (overlap@N, rank correlation and both latencies) are
+    appended to log_path as JSON lines and summed up in stats().
+    """
+
+    def __init__(self, directory, sample_rate, log_path, workers=1):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.log_path = log_path
+        self.workers = workers
+        # Spawned, not forked: a fork of the threaded server could copy a held lock.
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_load_candidate, initargs=(directory,),
+                                         mp_context=multiprocessing.get_context('spawn'))
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._pending = 0
+        self.counts = {'sampled': 0, 'dropped': 0, 'compared': 0, 'unknown_user': 0, 'failed': 0}
+        self.candidate_version = None
+        self._overlap_sum = 0.0
+        self._correlation_sum, self._correlated = 0.0, 0
+        self.production_latency = LatencyHistogram()
+        self.candidate_latency = LatencyHistogram()
+        # Starts every worker and loads the candidate now, not on the first sampled request.
+        for _ in range(workers):
+            self._pool.submit(_candidate_version).add_done_callback(self._loaded)
+
+    def _loaded(self, future):
+        try:
+            self.candidate_version = future.result()
+        except Exception as error:
+            print(f"Shadow model {self.directory} could not be loaded: {error!r}")
+
+    def offer(self, user_id, production_version, recommendations, seconds, **context):
+        """
+        Called on the request path with the production answer and its scoring
+        time. Returns at once; extra context (e.g. the variant) is logged as is.
+        """
+        if random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            if self._pending >= self.workers * PENDING_PER_WORKER:
+                self.counts['dropped'] += 1
+                return False
+            self._pending += 1
+            self.counts['sampled'] += 1
+        production = [pid for pid, *_ in recommendations]
+        try:
+            future = self._pool.submit(_score_candidate, user_id, len(production))
+        except Exception as error:
+            print(f"Shadow scoring could not be started: {error!r}")
+            self._finished('failed')
+            return False
+        future.add_done_callback(
+            lambda done: self._compare(done, user_id, production_version, production, seconds, context))
+        return True
+
+    def _finished(self, outcome):
+        with self._lock:
+            self._pending -= 1
+            self.counts[outcome] += 1
+
+    def _compare(self, future, user_id, production_version, production, seconds, context):
+        # Runs on the pool's result thread, never on a request thread.
+        try:
+            candidate_version, candidate, candidate_seconds = future.result()
+        except Exception as error:
+            print(f"Shadow scoring failed for user {user_id}: {error!r}")
+            self._finished('failed')
+            return
+        self.candidate_version = candidate_version
+        if candidate is None:
+            self._finished('unknown_user')
+            return
+
+        n = len(production)
+        record = {
+            'time': round(time.time(), 3),
+            'user_id': user_id,
+            'production_version': production_version,
+            'candidate_version': candidate_version,
+            'n': n,
+            'overlap': overlap_at(production, candidate, n),
+            'rank_correlation': rank_correlation(production, candidate),
+            'production_ms': round(seconds * 1000, 3),
+            'candidate_ms': round(candidate_seconds * 1000, 3),
+            **context,
+        }
+        with self._lock:
+            self._overlap_sum += record['overlap']
+            if record['rank_correlation'] is not None:
+                self._correlation_sum += record['rank_correlation']
+                self._correlated += 1
+            self.production_latency.record(seconds * 1e6)
+            self.candidate_latency.record(candidate_seconds * 1e6)
+        with self._log_lock:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        self._finished('compared')
+
+    def stats(self):
+        with self._lock:
+            compared = self.counts['compared']
+            return {
+                'candidate': self.directory,
+                'candidate_version': self.candidate_version,
+                'sample_rate': self.sample_rate,
+                'pending': self._pending,
+                **self.counts,
+                'mean_overlap': round(self._overlap_sum / compared, 4) if compared else None,
+                'mean_rank_correlation': (round(self._correlation_sum / self._correlated, 4)
+                                          if self._correlated else None),
+                'production_latency_ms': self.production_latency.summary_ms(),
+                'candidate_latency_ms': self.candidate_latency.summary_ms(),
+                'log': self.log_path,
+            }
+
+    def close(self):
+        # Pending comparisons are dropped; the workers exit once their current one is done.
+        self._pool.shutdown(wait=False, cancel_futures=True)
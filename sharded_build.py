@@ -0,0 +1,246 @@
+# sharded_build.py
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from neighbours import build_interaction_matrix, neighbours_for_rows, normalize_rows
+from recommender_model import RecommenderModel, save_model
+from sizing import SIMILARITY_BLOCK_ROWS
+
+# A claim with no result after this long is assumed to belong to a dead worker.
+CLAIM_TIMEOUT_SECONDS = 3600
+
+# Layout of a job directory on the shared filesystem:
+#   job.json                      job parameters, written by prepare_job
+#   matrix/                       normalised item x user CSR and its transpose (.npy)
+#   model/                        model arrays in the save_model layout
+#   claims/shard_NNNNN.claim      created exclusively by the worker computing a shard
+#   partial/shard_NNNNN.npz       top-k lists of one shard, renamed into place when complete
+
+
+def _path(job_dir, *parts):
+    return os.path.join(job_dir, *parts)
+
+
+def _shard_name(shard):
+    return f"shard_{shard:05d}"
+
+
+def _write_atomically(path, write):
+    # Readers on other machines must never see a half-written file, so every
+    # file is written under a temporary name and renamed into place.
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _load_job(job_dir):
+    with open(_path(job_dir, 'job.json')) as f:
+        return json.load(f)
+
+
+def _shard_bounds(job, shard):
+    # Shards differ in size by at most one item, so none starts past the last item.
+    n_items, n_shards = job['n_items'], job['n_shards']
+    return shard * n_items // n_shards, (shard + 1) * n_items // n_shards
+
+
+def _shards(job):
+    # Shards with at least one item; a job over very few items has no others.
+    return [shard for shard in range(job['n_shards']) if _shard_bounds(job, shard)[0] < _shard_bounds(job, shard)[1]]
+
+
+def prepare_job(df, job_dir, n_shards, k=50):
+    """
+    Writes everything the workers need into job_dir: the normalised matrix,
+    the id maps and user ratings of the final model, and the job parameters.
+    Anything left in job_dir by an earlier job is removed first.
+    """
+    # Claims and partial results of an earlier job would make the workers skip
+    # their shards and merge_job copy in that job's neighbour lists.
+    for name in ('job.json', 'matrix', 'model', 'claims', 'partial'):
+        path = _path(job_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    matrix, item_ids, user_ids = build_interaction_matrix(df)
+    normalized = normalize_rows(matrix)
+    os.makedirs(_path(job_dir, 'matrix'), exist_ok=True)
+    for name, csr in (('normalized', normalized), ('transposed', normalized.T.tocsr())):
+        for part in ('data', 'indices', 'indptr'):
+            np.save(_path(job_dir, 'matrix', f"{name}_{part}.npy"), getattr(csr, part))
+
+    # The model directory starts with empty neighbour arrays; merge_job fills them in.
+    width = min(k, len(item_ids))
+    empty_items = np.full((len(item_ids), width), -1, dtype=np.int32)
+    empty_scores = np.zeros((len(item_ids), width), dtype=np.float32)
+    save_model(RecommenderModel(item_ids, user_ids, matrix.T.tocsr(), empty_items, empty_scores),
+               _path(job_dir, 'model'))
+
+    for directory in ('claims', 'partial'):
+        os.makedirs(_path(job_dir, directory))
+    n_items = len(item_ids)
+    n_shards = max(1, min(n_shards, n_items))
+    job = {
+        'n_items': n_items,
+        'n_users': len(user_ids),
+        'k': k,
+        'n_shards': n_shards,
+    }
+    _write_atomically(_path(job_dir, 'job.json'), lambda f: f.write(json.dumps(job).encode()))
+    print(f"Prepared job in {job_dir}: {n_items} items in {n_shards} shards, k={k}.")
+    return job
+
+
+def _load_matrix(job_dir, name, shape):
+    arrays = [np.load(_path(job_dir, 'matrix', f"{name}_{part}.npy"), mmap_mode='r')
+              for part in ('data', 'indices', 'indptr')]
+    return sparse.csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+def _try_claim(job_dir, shard, worker_id, claim_timeout):
+    claim_path = _path(job_dir, 'claims', _shard_name(shard) + '.claim')
+    try:
+        if time.time() - os.path.getmtime(claim_path) > claim_timeout:
+            print(f"Reclaiming stale claim on {_shard_name(shard)}.")
+            os.remove(claim_path)
+    except FileNotFoundError:
+        pass
+    try:
+        fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'worker': worker_id, 'time': time.time()}, f)
+    return True
+
+
+def run_worker(job_dir, worker_id=None, block_rows=SIMILARITY_BLOCK_ROWS, claim_timeout=CLAIM_TIMEOUT_SECONDS):
+    """
+    Claims unfinished shards one at a time and writes their top-k lists to
+    partial/. Any number of workers, on any number of machines sharing job_dir,
+    can run at once; each returns when no unclaimed shard is left.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    job = _load_job(job_dir)
+    shape = (job['n_items'], job['n_users'])
+    normalized = _load_matrix(job_dir, 'normalized', shape)
+    transposed = _load_matrix(job_dir, 'transposed', shape[::-1])
+
+    done = 0
+    for shard in _shards(job):
+        partial_path = _path(job_dir, 'partial', _shard_name(shard) + '.npz')
+        if os.path.exists(partial_path) or not _try_claim(job_dir, shard, worker_id, claim_timeout):
+            continue
+        start, stop = _shard_bounds(job, shard)
+        print(f"[{worker_id}] Computing {_shard_name(shard)} (items {start}-{stop - 1})...")
+        items, scores = neighbours_for_rows(normalized, transposed, start, stop, job['k'], block_rows)
+        _write_atomically(partial_path, lambda f: np.savez(f, items=items, scores=scores))
+        done += 1
+    print(f"[{worker_id}] No shards left to claim; computed {done}.")
+    return done
+
+
+def merge_job(job_dir):
+    """
+    Combines the per-shard top-k lists into the neighbour arrays of job_dir/model,
+    which can then be opened with recommender_model.load_model.
+    Returns False without writing anything while shards are still missing.
+    """
+    job = _load_job(job_dir)
+    shards = _shards(job)
+    partial_paths = [_path(job_dir, 'partial', _shard_name(shard) + '.npz') for shard in shards]
+    missing = [path for path in partial_paths if not os.path.exists(path)]
+    if missing:
+        print(f"Cannot merge yet: {len(missing)} of {len(shards)} shards are not finished.")
+        return False
+
+    model_dir = _path(job_dir, 'model')
+    neighbour_items = np.load(_path(model_dir, 'neighbour_items.npy'), mmap_mode='r+')
+    neighbour_scores = np.load(_path(model_dir, 'neighbour_scores.npy'), mmap_mode='r+')
+    for shard, path in zip(shards, partial_paths):
+        start, stop = _shard_bounds(job, shard)
+        with np.load(path) as partial:
+            neighbour_items[start:stop] = partial['items']
+            neighbour_scores[start:stop] = partial['scores']
+    neighbour_items.flush()
+    neighbour_scores.flush()
+    print(f"Merged {len(shards)} shards into {model_dir}.")
+    return True
+
+
+def run_local(df, job_dir, n_shards, workers, k=50):
+    """
+    Runs the whole sharded build on this machine, with separate processes
+    standing in for the worker nodes.
+    """
+    prepare_job(df, job_dir, n_shards, k)
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', job_dir])
+                 for _ in range(workers)]
+    for process in processes:
+        process.wait()
+    return merge_job(job_dir)
+
+
+def _read_interactions(csv_path, min_interactions):
+    df = pd.read_csv(csv_path, usecols=['user_id', 'product_id', 'rating'])
+    user_counts = df['user_id'].value_counts()
+    product_counts = df['product_id'].value_counts()
+    filtered_users = user_counts[user_counts >= min_interactions].index
+    filtered_products = product_counts[product_counts >= min_interactions].index
+    return df[df['user_id'].isin(filtered_users) & df['product_id'].isin(filtered_products)]
+
+
+# --- Main entry point ---
+# prepare once, start "worker" on every node that can see job_dir, then merge.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded item-neighbour build over a shared directory.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    prepare = commands.add_parser('prepare', help="write the job directory")
+    prepare.add_argument('csv_path')
+    prepare.add_argument('job_dir')
+    prepare.add_argument('--shards', type=int, default=64)
+    prepare.add_argument('--k', type=int, default=50)
+    prepare.add_argument('--min-interactions', type=int, default=5)
+
+    worker = commands.add_parser('worker', help="compute shards until none are left")
+    worker.add_argument('job_dir')
+
+    merge = commands.add_parser('merge', help="combine finished shards into the model")
+    merge.add_argument('job_dir')
+
+    local = commands.add_parser('local', help="prepare, run local workers and merge")
+    local.add_argument('csv_path')
+    local.add_argument('job_dir')
+    local.add_argument('--shards', type=int, default=64)
+    local.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    local.add_argument('--k', type=int, default=50)
+    local.add_argument('--min-interactions', type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == 'prepare':
+        prepare_job(_read_interactions(args.csv_path, args.min_interactions), args.job_dir, args.shards, args.k)
+    elif args.command == 'worker':
+        run_worker(args.job_dir)
+    elif args.command == 'merge':
+        sys.exit(0 if merge_job(args.job_dir) else 1)
+    else:
+        ok = run_local(_read_interactions(args.csv_path, args.min_interactions), args.job_dir,
+                       args.shards, args.workers, args.k)
+        sys.exit(0 if ok else 1)
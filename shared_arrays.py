@@ -0,0 +1,39 @@
+# shared_arrays.py
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# NumPy arrays handed to worker processes through shared memory. Only a spec
+# (segment name, shape, dtype) is pickled; every process maps the same bytes.
+# The parent keeps the segments it created in a list and unlinks them when done.
+
+
+def share_array(array, segments):
+    """
+    Copies array into a new shared memory segment, appended to segments, and
+    returns the spec that attach_array maps it back from.
+    """
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    segments.append(segment)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment.name, array.shape, array.dtype.str
+
+
+def attach_array(spec, segments):
+    """
+    The array of a spec from share_array, mapped without copying. Its segment
+    is appended to segments and must outlive the array.
+    """
+    name, shape, dtype = spec
+    segment = shared_memory.SharedMemory(name=name)
+    segments.append(segment)
+    return np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def copy_shared(spec, segments_by_name):
+    """
+    A private copy of a shared array, so it survives its segment being unlinked.
+    """
+    name, shape, dtype = spec
+    return np.ndarray(shape, dtype=dtype, buffer=segments_by_name[name].buf).copy()
@@ -0,0 +1,64 @@
+# sizing.py
+
+import numpy as np
+from scipy.stats import binom
+
+# Approximate per-element costs of what a model build allocates.
+BYTES_PER_SAMPLE_ROW = 160   # one row of the sampled DataFrame (two id strings, rating, timestamp)
+BYTES_PER_NNZ = 8            # float32 value + int32 index in a CSR matrix
+BYTES_PER_NEIGHBOUR = 8      # int32 item code + float32 similarity
+BYTES_PER_DENSE_CELL = 8     # float64 cell of the pivot table / full similarity matrix
+BYTES_PER_BLOCK_CELL = 24    # sparse block product + dense float32 copy + argpartition indices
+
+SIMILARITY_BLOCK_ROWS = 1024
+
+
+def estimate_model_bytes(n_users, n_items, nnz, k=None, block_rows=SIMILARITY_BLOCK_ROWS, workers=1):
+    """
+    Estimates the peak memory of a model build from interaction counts alone.
+    With k=None the estimate is for a dense pivot table plus the full item
+    similarity matrix; otherwise for the sparse matrices plus a top-k
+    neighbour index, with one block workspace per build worker.
+    Works element-wise on NumPy arrays.
+    """
+    sample = nnz * BYTES_PER_SAMPLE_ROW
+    if k is None:
+        matrix = n_items * n_users * BYTES_PER_DENSE_CELL
+        neighbours = n_items * n_items * BYTES_PER_DENSE_CELL
+        workspace = matrix  # cosine_similarity normalises a copy of the matrix
+    else:
+        # item x user CSR, its normalised copy and transpose, and the user x item CSR kept for serving
+        matrix = 4 * nnz * BYTES_PER_NNZ + 2 * (n_items + n_users + 2) * 4
+        neighbours = n_items * k * BYTES_PER_NEIGHBOUR
+        workspace = workers * np.minimum(block_rows, n_items) * n_items * BYTES_PER_BLOCK_CELL
+    return {
+        'sample': sample,
+        'matrix': matrix,
+        'neighbours': neighbours,
+        'workspace': workspace,
+        'total': sample + matrix + neighbours + workspace,
+    }
+
+
+def expected_items(product_counts, fraction, min_interactions):
+    """
+    Expected number of products that keep at least min_interactions ratings
+    when the given fraction of all ratings ends up in the sample.
+    """
+    counts, multiplicity = np.unique(np.asarray(product_counts, dtype=np.int64), return_counts=True)
+    fraction = np.clip(np.atleast_1d(fraction), 0.0, 1.0)
+    survive = binom.sf(min_interactions - 1, counts[:, None], fraction[None, :])
+    return multiplicity @ survive
+
+
+def mib(n_bytes):
+    return f"{n_bytes / 2**20:,.1f} MiB"
+
+
+def print_sizing_report(plans, memory_budget_bytes):
+    print(f"\nSizing report (memory budget {mib(memory_budget_bytes)}):")
+    print(f"  {'k':>5} {'min_int':>7} {'records':>10} {'users':>9} {'items':>9} {'estimate':>14}  fits")
+    for plan in plans:
+        k = 'dense' if plan['k'] is None else plan['k']
+        print(f"  {k:>5} {plan['min_interactions']:>7} {plan['row_budget']:>10} {plan['users']:>9} "
+              f"{plan['items']:>9} {mib(plan['estimated_bytes']):>14}  {'yes' if plan['fits'] else 'no'}")
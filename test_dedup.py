@@ -0,0 +1,18 @@
+# test_dedup.py
+
+import numpy as np
+
+from dedup import deduplicate_pairs
+
+
+def test_mean_of_integer_ratings_keeps_the_fraction():
+    rows, cols, values, _ = deduplicate_pairs([0, 0, 1], [1, 1, 0], np.array([4, 5, 3]), 2)
+    assert rows.tolist() == [0, 1] and cols.tolist() == [1, 0]
+    assert values.dtype == np.float64
+    assert values.tolist() == [4.5, 3.0]
+
+
+def test_latest_keeps_the_input_dtype():
+    _, _, values, latest = deduplicate_pairs([0, 0], [0, 0], np.array([2, 5]), 1, times=[20, 10], keep='latest')
+    assert values.tolist() == [2] and values.dtype == np.array([2]).dtype
+    assert latest.tolist() == [0]
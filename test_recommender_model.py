@@ -0,0 +1,29 @@
+# test_recommender_model.py
+
+import numpy as np
+
+from recommender_model import CsrArrays, RecommenderModel
+
+
+def _model():
+    # Three items; item 2 has no neighbours at all, items 0 and 1 only have each other.
+    item_ids = np.array(['A', 'B', 'C'])
+    user_ids = np.array(['u1', 'u2'])
+    # u1 rated A and B, u2 rated C.
+    user_items = CsrArrays(np.array([5.0, 4.0, 3.0]), np.array([0, 1, 2]), np.array([0, 2, 3]), (2, 3))
+    neighbour_items = np.array([[1, -1], [0, -1], [-1, -1]], dtype=np.int32)
+    neighbour_scores = np.array([[0.9, 0.0], [0.9, 0.0], [0.0, 0.0]], dtype=np.float32)
+    return RecommenderModel(item_ids, user_ids, user_items, neighbour_items, neighbour_scores)
+
+
+def test_explain_with_no_scored_items():
+    model = _model()
+    # Every neighbour of u1's products is already rated, and C has no neighbours.
+    assert model.recommend('u1', explain=True) == []
+    assert model.recommend('u2', explain=True) == []
+    assert model.recommend_for_items(['C'], explain=True) == []
+
+
+def test_explain_names_the_contributing_product():
+    recommendations = _model().recommend_for_items(['A'], explain=True)
+    assert recommendations == [('B', recommendations[0][1], [('A', 1.0)])]
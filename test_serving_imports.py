@@ -0,0 +1,7 @@
+# test_serving_imports.py
+
+from check_serving_imports import check_serving_imports
+
+
+def test_api_import_is_lean():
+    assert check_serving_imports() == []
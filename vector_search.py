@@ -0,0 +1,263 @@
+# vector_search.py
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+# Items scored per step of a scan; bounds the temporary queries x block score matrix.
+SEARCH_BLOCK_ROWS = 65536
+
+# A quantized search takes rerank * k candidates from the int8 codes and
+# rescores them with the float32 vectors, when those are available.
+DEFAULT_RERANK = 4
+
+
+def quantize_int8(vectors, block_rows=SEARCH_BLOCK_ROWS):
+    """
+    Symmetric scalar quantization per dimension: code = round(x / scale) with
+    scale = max |x| / 127 over the items. Returns (int8 codes, float32 scales);
+    codes * scales approximates the vectors at a quarter of their size.
+    """
+    scale = np.zeros(vectors.shape[1], dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        np.maximum(scale, np.abs(vectors[start:start + block_rows]).max(axis=0), out=scale)
+    scale = np.where(scale > 0, scale / 127, 1).astype(np.float32)
+    codes = np.empty(vectors.shape, dtype=np.int8)
+    for start in range(0, len(vectors), block_rows):
+        codes[start:start + block_rows] = np.clip(np.rint(vectors[start:start + block_rows] / scale), -127, 127)
+    return codes, scale
+
+
+def _merge_top_k(items, scores, more_items, more_scores, k):
+    # Best k per row of two candidate sets, highest score first.
+    items = np.concatenate([items, more_items], axis=1)
+    scores = np.concatenate([scores, more_scores], axis=1)
+    if scores.shape[1] > k:
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        items, scores = np.take_along_axis(items, best, 1), np.take_along_axis(scores, best, 1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(items, order, 1), np.take_along_axis(scores, order, 1)
+
+
+class ExactIndex:
+    """
+    Brute-force top-k over float32 item vectors, scanned in blocks so the
+    vectors can be memory-mapped and the scores never exceed one block.
+
+    metric 'dot' ranks by query . vector (+ item bias, when given), e.g. a user
+    factor against item factors; 'cosine' ranks by the angle, e.g. an item's
+    vector against all others. norms are the vectors' lengths.
+    """
+
+    def __init__(self, vectors, norms, bias=None, block_rows=SEARCH_BLOCK_ROWS):
+        self.vectors = vectors
+        self.norms = np.where(norms > 0, norms, 1).astype(np.float32)
+        self.bias = bias
+        self.block_rows = block_rows
+
+    def __len__(self):
+        return len(self.norms)
+
+    def vector(self, code):
+        return np.asarray(self.vectors[code], dtype=np.float32)
+
+    def _scores(self, queries, start, stop, metric):
+        scores = queries @ self.vectors[start:stop].T
+        if metric == 'cosine':
+            return scores / self.norms[start:stop]
+        return scores if self.bias is None else scores + self.bias[start:stop]
+
+    def search(self, queries, k=10, metric='dot', exclude=None):
+        """
+        The k best items for each row of queries (a Q x D array), as
+        (item codes, scores), both Q x k and best first; -1 pads rows with
+        fewer than k items. exclude is an optional list, one per query, of item
+        codes not to return. Cosine scores are divided by the query's length.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if metric not in ('dot', 'cosine'):
+            raise ValueError(f"unknown metric {metric!r}")
+        # (query, item) pairs to skip, ordered by item so every block takes a slice.
+        excluded_rows = np.concatenate([np.full(len(codes), row) for row, codes in enumerate(exclude)]) \
+            if exclude else np.empty(0, dtype=np.int64)
+        excluded_items = np.concatenate([np.asarray(codes, dtype=np.int64) for codes in exclude]) \
+            if exclude else np.empty(0, dtype=np.int64)
+        order = np.argsort(excluded_items, kind='stable')
+        excluded_rows, excluded_items = excluded_rows[order].astype(np.int64), excluded_items[order]
+
+        best_items = np.full((len(queries), 0), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            stop = min(start + self.block_rows, len(self))
+            scores = self._scores(queries, start, stop, metric)
+            first, last = np.searchsorted(excluded_items, [start, stop])
+            scores[excluded_rows[first:last], excluded_items[first:last] - start] = -np.inf
+            width = min(k, stop - start)
+            top = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+            best_items, best_scores = _merge_top_k(best_items, best_scores, top + start,
+                                                   np.take_along_axis(scores, top, 1), k)
+
+        if metric == 'cosine':
+            best_scores = best_scores / np.maximum(np.linalg.norm(queries, axis=1), 1e-12)[:, None]
+        best_items[~np.isfinite(best_scores)] = -1
+        return best_items, best_scores
+
+
+class QuantizedIndex(ExactIndex):
+    """
+    ExactIndex scanned over int8 codes of the unit-length item vectors
+    (quantize_int8): a quarter of the memory and of the bytes read per scan.
+    Each block is widened to float32 just before its matrix product. With the
+    float32 vectors at hand, the rerank * k best candidates are rescored
+    exactly, which recovers nearly all of the exact top-k.
+    """
+
+    def __init__(self, codes, scale, norms, bias=None, vectors=None, rerank=DEFAULT_RERANK,
+                 block_rows=SEARCH_BLOCK_ROWS):
+        super().__init__(vectors, norms, bias, block_rows)
+        self.codes = codes
+        self.scale = scale
+        self.rerank = rerank
+
+    def vector(self, code):
+        if self.vectors is not None:
+            return super().vector(code)
+        return self.codes[code].astype(np.float32) * self.scale * self.norms[code]
+
+    def _scores(self, queries, start, stop, metric):
+        # The codes hold unit vectors: scaling by the norms turns the angle back into a dot product.
+        scores = (queries * self.scale) @ self.codes[start:stop].T.astype(np.float32)
+        if metric == 'cosine':
+            return scores
+        scores *= self.norms[start:stop]
+        return scores if self.bias is None else scores + self.bias[start:stop]
+
+    def search(self, queries, k=10, metric='dot', exclude=None):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.vectors is None or self.rerank <= 1:
+            return super().search(queries, k, metric, exclude)
+        candidates, _ = super().search(queries, k * self.rerank, metric, exclude)
+        found = candidates >= 0
+        rows = self.vectors[np.where(found, candidates, 0).ravel()].reshape(*candidates.shape, -1)
+        scores = np.einsum('qd,qcd->qc', queries, rows.astype(np.float32, copy=False))
+        if metric == 'cosine':
+            scores /= self.norms[np.where(found, candidates, 0)]
+            scores /= np.maximum(np.linalg.norm(queries, axis=1), 1e-12)[:, None]
+        elif self.bias is not None:
+            scores += self.bias[np.where(found, candidates, 0)]
+        scores[~found] = -np.inf
+        empty = np.empty((len(queries), 0))
+        items, scores = _merge_top_k(empty.astype(np.int64), empty.astype(np.float32), candidates, scores, k)
+        items[~np.isfinite(scores)] = -1
+        return items, scores
+
+
+class EmbeddingIndex:
+    """
+    Item vectors from an embeddings directory (see embeddings.py) behind one
+    search engine for both kinds of query: a user's products by dot product
+    with the user's vector, and a product's neighbours by cosine.
+    """
+
+    def __init__(self, item_ids, index, user_ids=None, user_vectors=None, version=None):
+        self.item_ids = item_ids
+        self.index = index
+        self.user_ids = user_ids
+        self.user_vectors = user_vectors
+        self.version = version
+        self.item_index = {item_id: code for code, item_id in enumerate(item_ids.tolist())}
+        self.user_index = {} if user_ids is None else {user_id: code for code, user_id in enumerate(user_ids.tolist())}
+
+    def _pairs(self, items, scores):
+        return [(str(self.item_ids[item]), float(score)) for item, score in zip(items, scores) if item >= 0]
+
+    def similar_items(self, product_id, num_similar=10):
+        """
+        The num_similar products closest to product_id by cosine, or None when it is unknown.
+        """
+        code = self.item_index.get(product_id)
+        if code is None:
+            return None
+        items, scores = self.index.search(self.index.vector(code), num_similar, 'cosine', exclude=[[code]])
+        return self._pairs(items[0], scores[0])
+
+    def recommend(self, user_id, num_recommendations=10, exclude=None):
+        """
+        The user's best products by dot product, skipping the item codes in
+        exclude (e.g. what the user already has); [] for an unknown user.
+        """
+        code = self.user_index.get(user_id)
+        if code is None:
+            return []
+        items, scores = self.index.search(self.user_vectors[code], num_recommendations, 'dot',
+                                          exclude=None if exclude is None else [exclude])
+        return self._pairs(items[0], scores[0])
+
+
+def load_embedding_index(directory, quantized=False, rerank=DEFAULT_RERANK, mmap_mode='r'):
+    """
+    An EmbeddingIndex over an embeddings directory, memory-mapped. With
+    quantized, scans read the int8 codes; the float32 vectors are then only
+    touched to rerank candidates (rerank=0 skips that too).
+    """
+    def load(name):
+        path = os.path.join(directory, name + '.npy')
+        return np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+
+    with open(os.path.join(directory, 'embeddings.json')) as f:
+        info = json.load(f)
+    norms, bias = load('item_norms'), load('item_bias')
+    if quantized:
+        index = QuantizedIndex(load('item_codes'), load('item_code_scale'), norms, bias,
+                               load('item_vectors') if rerank else None, rerank)
+    else:
+        index = ExactIndex(load('item_vectors'), norms, bias)
+    return EmbeddingIndex(load('item_ids'), index, load('user_ids'), load('user_vectors'), info.get('version'))
+
+
+def compare_indexes(directory, num_queries=200, k=10, seed=42):
+    """
+    Recall@k and time per query of the quantized search (with and without
+    reranking) against the exact one, on random products' neighbour queries.
+    """
+    exact = load_embedding_index(directory)
+    rng = np.random.default_rng(seed)
+    codes = rng.choice(len(exact.item_ids), min(num_queries, len(exact.item_ids)), replace=False)
+    queries = np.stack([exact.index.vector(code) for code in codes])
+    exclude = [[code] for code in codes]
+
+    started = time.perf_counter()
+    truth, _ = exact.index.search(queries, k, 'cosine', exclude)
+    report = {'exact': {'ms_per_query': 1000 * (time.perf_counter() - started) / len(codes)}}
+    for name, rerank in (('int8', 0), ('int8_rerank', DEFAULT_RERANK)):
+        index = load_embedding_index(directory, quantized=True, rerank=rerank).index
+        started = time.perf_counter()
+        found, _ = index.search(queries, k, 'cosine', exclude)
+        seconds = time.perf_counter() - started
+        recall = np.mean([len(set(a[a >= 0]) & set(b[b >= 0])) / max(1, (a >= 0).sum()) for a, b in zip(truth, found)])
+        report[name] = {'ms_per_query': 1000 * seconds / len(codes), f'recall@{k}': float(recall)}
+    return report
+
+
+# --- Main entry point ---
+# e.g. python vector_search.py D:\Datasets\embeddings --product B000YM2OIK --quantized
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query or benchmark an embeddings directory.")
+    parser.add_argument('directory')
+    parser.add_argument('--product', help="list the products most similar to this one")
+    parser.add_argument('--user', help="list the best products for this user")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--quantized', action='store_true')
+    parser.add_argument('--compare', action='store_true', help="recall and speed of int8 search against exact")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare_indexes(args.directory, k=args.k), indent=2))
+    engine = load_embedding_index(args.directory, quantized=args.quantized)
+    if args.product:
+        print(json.dumps(engine.similar_items(args.product, args.k), indent=2))
+    if args.user:
+        print(json.dumps(engine.recommend(args.user, args.k), indent=2))